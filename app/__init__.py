@@ -5,24 +5,40 @@ from flask import Flask
 from flask.ext.bootstrap import Bootstrap
 from flask.ext.mail import Mail
 from flask.ext.moment import Moment
-from flask.ext.sqlalchemy import SQLAlchemy
 from flask.ext.login import LoginManager
 from flask.ext.pagedown import PageDown
 from flask_debugtoolbar import DebugToolbarExtension
 
 from config import config
+from app.cache import PageCache, ModelCache
+from app.search import Search
+from app.markup import renderer
+from app.presence import Presence
+from app.compress import Compress
+from app.metrics import Metrics
+from app.queryguard import QueryGuard
+from app.executor import Executor
+from app.database import Database
 
 __author__ = 'zhangmm'
 
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = Database()
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
 login_manager.login_view = 'auth.login'
 pagedown = PageDown()
 toolbar = DebugToolbarExtension()
+page_cache = PageCache()
+search = Search()
+presence = Presence()
+user_cache = ModelCache()
+metrics = Metrics()
+query_guard = QueryGuard()
+executor = Executor()
+compress = Compress()
 
 
 def create_app(config_name):
@@ -37,6 +53,19 @@ def create_app(config_name):
     login_manager.init_app(app)
     pagedown.init_app(app)
     toolbar.init_app(app)
+    page_cache.init_app(app)
+    search.init_app(app)
+    presence.init_app(app)
+    metrics.init_app(app)
+    query_guard.init_app(app)
+    executor.init_app(app)
+    compress.init_app(app)
+    renderer.cache.max_size = app.config['ZBLOG_MARKDOWN_CACHE_SIZE']
+    renderer.summary_length = app.config['ZBLOG_SUMMARY_LENGTH']
+    user_cache.ttl = app.config['ZBLOG_USER_CACHE_TTL']
+    user_cache.clear()
+    if app.config['ZBLOG_DB_REPORT']:
+        db.log_report(app)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -7,4 +7,4 @@ __author__ = 'zhangmm'
 
 api = Blueprint('api', __name__)
 
-from app.api_1_0 import authentication, posts, users, errors
+from app.api_1_0 import authentication, posts, users, search, errors
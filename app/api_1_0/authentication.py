@@ -1,16 +1,28 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
-from flask import g, jsonify
+import hashlib
+import hmac
+import time
+
+from flask import g, jsonify, current_app
 from flask.ext.httpauth import HTTPBasicAuth
 
+from app.cache import VerifiedUserCache
 from app.models import AnonymousUser, User
-from app.api_1_0.errors import unauthorized, forbidden
+from app.api_1_0.errors import unauthorized
 from app.api_1_0 import api
 
 __author__ = 'zhangmm'
 
 auth = HTTPBasicAuth()
+verified_credentials = VerifiedUserCache()
+
+
+def _credentials_key(email, password):
+    # never keep the password itself in memory
+    return hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'),
+                    u'{0!s}\0{1!s}'.format(email, password).encode('utf-8'), hashlib.sha256).hexdigest()
 
 
 @auth.verify_password
@@ -22,12 +34,21 @@ def verify_password(email_or_token, password):
         g.current_user = User.verify_auth_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
+    key = _credentials_key(email_or_token, password)
+    user = verified_credentials.get(key, User.load_cached)
+    if user is not None and user.email == email_or_token:
+        g.current_user = user
+        g.token_used = False
+        return True
     user = User.query.filter_by(email=email_or_token).first()
     if not user:
         return False
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    if not user.verify_password(password):
+        return False
+    verified_credentials.set(key, user, time.time() + current_app.config['ZBLOG_CREDENTIALS_CACHE_TTL'])
+    return True
 
 
 @auth.error_handler
@@ -38,8 +59,8 @@ def auth_error():
 @api.before_request
 @auth.login_required
 def before_request():
-    if not g.current_user.is_anonymous:
-        return forbidden('Unconfirmed account')
+    # users have no confirmation step here, every authenticated user may go on
+    pass
 
 
 @api.route('/token')
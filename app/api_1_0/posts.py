@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
-from flask import request, current_app, url_for, jsonify, g
+import json
+from datetime import datetime
 
-from app import db
-from app.models import Post
+from flask import request, current_app, url_for, jsonify, g, abort, stream_with_context
+from flask import json as flask_json
+from six import string_types
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, page_cache
+from app.conditional import make_etag, not_modified, set_validators
+from app.exceptions import ValidationError
+from app.markup import renderer
+from app.models import Post, PostTags, Tag, SiteVersion
 from app.api_1_0 import api
+from app.pagination import Paginator
 from app.api_1_0.errors import forbidden
 
 __author__ = 'zhangmm'
@@ -13,28 +23,92 @@ __author__ = 'zhangmm'
 
 @api.route('/posts')
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
-        page, per_page=current_app.config['ZBLOG_POSTS_PER_PAGE'], error_out=False)
+    """The posts, newest first, by ``page`` with their total ``count``.
+
+    Cursors are opt-in: requests with ``after`` or ``before`` (``after=``
+    for the newest posts) walk the posts by key and leave out ``count``
+    unless asked with ``count=1``, which costs a COUNT over all posts.
+    """
+    version, last_modified = SiteVersion.current()
+    etag = make_etag(version)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator.from_request(current_app.config['ZBLOG_POSTS_PER_PAGE'], cursors=False)
+    pagination = paginator.paginate(Post.listing(Post.query, content=True))
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page - 1, _external=True)
-    next = None
-    if pagination.has_next:
-        url_for('api.get_posts', page=page + 1, _external=True)
-    return jsonify({
+    prev, next = paginator.links(pagination, 'api.get_posts', _external=True)
+    json_posts = {
         'posts': [post.to_json() for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total
-    })
+        'prev_cursor': getattr(pagination, 'prev_cursor', None),
+        'next_cursor': getattr(pagination, 'next_cursor', None)
+    }
+    if not paginator.keyset:
+        json_posts['count'] = pagination.total
+    elif request.args.get('count', type=int):
+        json_posts['count'] = Post.query.count()
+    return set_validators(jsonify(json_posts), etag, last_modified)
+
+
+def _parse_since(value):
+    for format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValidationError('since is not a timestamp like 2016-01-31T12:00:00')
+
+
+@api.route('/posts/export')
+def export_posts():
+    """Stream every post as one JSON object per line, optionally filtered by
+    ``author`` (user id), ``tag`` (name) or ``since`` (posts modified since).
+
+    Posts are read in id order, ``ZBLOG_EXPORT_CHUNK_SIZE`` at a time, so
+    memory stays flat and no transaction stays open while the client reads.
+    """
+    query = Post.query
+    author = request.args.get('author', type=int)
+    if author is not None:
+        query = query.filter(Post.author_id == author)
+    tag = request.args.get('tag')
+    if tag:
+        query = query.filter(Post.id.in_(db.session.query(PostTags.post_id).join(Tag, Tag.id == PostTags.tag_id)
+                                         .filter(Tag.name == tag)))
+    since = request.args.get('since')
+    if since:
+        query = query.filter(Post.modified >= _parse_since(since))
+    chunk_size = current_app.config['ZBLOG_EXPORT_CHUNK_SIZE']
+
+    def generate():
+        last_id = 0
+        while True:
+            posts = Post.listing(query.filter(Post.id > last_id), content=True) \
+                .order_by(Post.id).limit(chunk_size).all()
+            if not posts:
+                break
+            for post in posts:
+                yield flask_json.dumps(post.to_json()) + '\n'
+            last_id = posts[-1].id
+            # end the read transaction while the client consumes the chunk, nothing was written
+            db.session.rollback()
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 @api.route('/posts/<int:id>')
 def get_post(id):
-    post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    version, last_modified = Post.detail_version(Post.id == id)
+    if version is None:
+        abort(404)
+    etag = make_etag(version)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    post = Post.query.options(db.undefer_group('content')).get_or_404(id)
+    return set_validators(jsonify(post.to_json()), etag, last_modified)
 
 
 @api.route('/posts', methods=['POST'])
@@ -42,10 +116,104 @@ def new_post():
     post = Post.from_json(request.json)
     post.author = g.current_user
     db.session.add(post)
+    page_cache.invalidate('posts')
     db.session.commit()
     return jsonify(post.to_json()), 201, {'Location': url_for('api.get_post', id=post.id, _external=True)}
 
 
+def _batch_items():
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line.decode('utf-8'))
+                except ValueError:
+                    yield None
+        return
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise ValidationError('expected a JSON array of posts')
+    for item in items:
+        yield item
+
+
+def _batch_error(index, status, message):
+    return {'index': index, 'status': status, 'message': message}
+
+
+def _create_posts(items, offset):
+    renderer.prime([item.get('body') for item in items if isinstance(item, dict)],
+                   current_app.config['ZBLOG_BATCH_WORKERS'])
+    names = set()
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get('tags'), list):
+            names.update(name for name in item['tags'] if isinstance(name, string_types))
+    tag_ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)).all()) if names else {}
+
+    results = [None] * len(items)
+    posts = []
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('post is not a JSON object')
+            tags = item.get('tags') or []
+            if not isinstance(tags, list) or not all(isinstance(name, string_types) for name in tags):
+                raise ValidationError('tags must be a list of tag names')
+            unknown = [name for name in tags if name not in tag_ids]
+            if unknown:
+                raise ValidationError(u'unknown tags: {0!s}'.format(u', '.join(unknown)))
+            post = Post.from_json(item)
+        except ValidationError as e:
+            results[i] = _batch_error(offset + i, 400, e.args[0])
+            continue
+        post.author = g.current_user
+        posts.append((i, post, set(tag_ids[name] for name in tags)))
+    if not posts:
+        return results
+
+    db.session.add_all([post for _, post, _ in posts])
+    try:
+        db.session.flush()
+        created = [(i, post.id) for i, post, _ in posts]
+        rows = [{'post_id': post.id, 'tag_id': tag_id} for _, post, ids in posts for tag_id in ids]
+        if rows:
+            db.session.execute(PostTags.__table__.insert(), rows)
+        page_cache.invalidate('posts', 'tags')
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception('Failed to store a batch of posts')
+        for i, _, _ in posts:
+            results[i] = _batch_error(offset + i, 500, 'post could not be stored')
+        return results
+    for i, id in created:
+        results[i] = {'index': offset + i, 'status': 201, 'url': url_for('api.get_post', id=id, _external=True)}
+    return results
+
+
+@api.route('/posts/batch', methods=['POST'])
+def new_posts():
+    """Create many posts from a JSON array, or one JSON object per line with Content-Type application/x-ndjson.
+
+    Every ``ZBLOG_BATCH_CHUNK_SIZE`` posts are rendered in parallel and stored
+    in one transaction. The response lists the outcome of every item in the
+    order given; invalid items are skipped without failing the others.
+    """
+    chunk_size = current_app.config['ZBLOG_BATCH_CHUNK_SIZE']
+    results = []
+    chunk = []
+    for item in _batch_items():
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            results.extend(_create_posts(chunk, len(results)))
+            chunk = []
+    if chunk:
+        results.extend(_create_posts(chunk, len(results)))
+    created = sum(1 for result in results if result['status'] == 201)
+    return jsonify({'results': results, 'created': created, 'failed': len(results) - created})
+
+
 @api.route('/posts/<int:id>', methods=['PUT'])
 def edit_post(id):
     post = Post.query.get_or_404(id)
@@ -53,4 +221,5 @@ def edit_post(id):
         return forbidden('Insufficient permissions')
     post.body = request.json.get('body', post.body)
     db.session.add(post)
+    page_cache.invalidate('posts', 'post:' + post.url_title)
     return jsonify(post.to_json())
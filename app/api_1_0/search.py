@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+from flask import request, current_app, url_for, jsonify
+
+from app import search as post_search
+from app.api_1_0 import api
+
+__author__ = 'zhangmm'
+
+
+@api.route('/search')
+def search_posts():
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    pagination = post_search.query(q, page, current_app.config['ZBLOG_POSTS_PER_PAGE'], content=True)
+    prev = None
+    if pagination.has_prev:
+        prev = url_for('api.search_posts', q=q, page=page - 1, _external=True)
+    next = None
+    if pagination.has_next:
+        next = url_for('api.search_posts', q=q, page=page + 1, _external=True)
+    return jsonify({
+        'posts': [post.to_json() for post in pagination.items],
+        'prev': prev,
+        'next': next,
+        'count': pagination.total
+    })
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
-from flask import jsonify, request, current_app, url_for
+from flask import jsonify, current_app, request
 
 from app.api_1_0 import api
-from app.models import User, Post
+from app.pagination import Paginator
+from app.conditional import make_etag, not_modified, set_validators
+from app.models import User, Post, SiteVersion
 
 __author__ = 'zhangmm'
 
@@ -12,26 +14,36 @@ __author__ = 'zhangmm'
 @api.route('/users/<int:id>')
 def get_user(id):
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    post_count = user.posts.count()
+    etag = make_etag(user.id, user.username, user.member_since, user.last_seen, post_count)
+    response = not_modified(etag)
+    if response:
+        return response
+    return set_validators(jsonify(user.to_json(post_count)), etag)
 
 
 @api.route('/users/<int:id>/posts')
 def get_user_posts(id):
+    """The posts of a user, paginated and counted like get_posts."""
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['ZBLOG_POSTS_PER_PAGE'], error_out=False
-    )
+    version, last_modified = SiteVersion.current()
+    etag = make_etag(version)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator.from_request(current_app.config['ZBLOG_POSTS_PER_PAGE'], cursors=False)
+    pagination = paginator.paginate(Post.listing(user.posts, content=True))
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page - 1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_posts', page=page + 1, _external=True)
-    return jsonify({
+    prev, next = paginator.links(pagination, 'api.get_user_posts', id=id, _external=True)
+    json_posts = {
         'posts': [post.to_json() for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total
-    })
+        'prev_cursor': getattr(pagination, 'prev_cursor', None),
+        'next_cursor': getattr(pagination, 'next_cursor', None)
+    }
+    if not paginator.keyset:
+        json_posts['count'] = pagination.total
+    elif request.args.get('count', type=int):
+        json_posts['count'] = user.posts.count()
+    return set_validators(jsonify(json_posts), etag, last_modified)
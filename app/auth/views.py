@@ -43,6 +43,7 @@ def change_password():
     form = ChangePwdForm()
     if form.validate_on_submit():
         if current_user.verify_password(form.old_password.data):
+            current_user.uncache()
             current_user.password = form.password.data
             db.session.add(current_user)
             logout_user()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import json
+import math
+import os
+import platform
+import random
+import time
+from base64 import b64encode
+
+from flask import url_for
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__author__ = 'zhangmm'
+
+TIERS = (1000, 10000, 100000)
+# metrics compared against the baseline, and the absolute change always tolerated
+COMPARED = (('p95', 0.002), ('queries', 0.5))
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of ``values``."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def _basic_auth(username, password):
+    return {'Authorization': 'Basic ' + b64encode((username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'}
+
+
+def _routes(rng):
+    from app.models import db, Post, Tag, User
+
+    titles = [title for title, in db.session.query(Post.url_title).limit(1000)]
+    ids = [id for id, in db.session.query(Post.id).limit(1000)]
+    names = [name for name, in db.session.query(Tag.name)]
+    usernames = [username for username, in db.session.query(User.username).limit(100)]
+    user = User.query.first()
+    token = user.generate_auth_token(3600)
+    anonymous = _basic_auth('', '')
+    return [
+        ('index', lambda: (url_for('main.index'), {})),
+        ('posts', lambda: (url_for('main.posts'), {})),
+        ('post', lambda: (url_for('main.post', title=rng.choice(titles)), {})),
+        ('tag', lambda: (url_for('main.tag', name=rng.choice(names)), {})),
+        ('user', lambda: (url_for('main.user', username=rng.choice(usernames)), {})),
+        ('api.get_posts', lambda: (url_for('api.get_posts'), anonymous)),
+        ('api.get_post', lambda: (url_for('api.get_post', id=rng.choice(ids)), anonymous)),
+        ('api.token_auth', lambda: (url_for('api.get_posts'), _basic_auth(token, ''))),
+    ]
+
+
+def _measure(client, route, count):
+    durations = []
+    queries = []
+    statuses = {}
+    for i in range(count):
+        url, headers = route()
+        start = time.time()
+        response = client.get(url, headers=headers)
+        durations.append(time.time() - start)
+        queries.append(int(response.headers.get('X-Query-Count', 0)))
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    return durations, queries, statuses
+
+
+def _peak_memory(client, route, count):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        for i in range(count):
+            url, headers = route()
+            client.get(url, headers=headers)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_tier(posts, directory, requests=50, warmup=5, reseed=False, seed=0, progress=None):
+    """Benchmark the routes against a database of ``posts`` posts, seeded once into ``directory``."""
+    from app import create_app, db
+    from app.models import Post
+    from app.seed import seed as seed_database
+
+    app = create_app('benchmark')
+    path = os.path.join(os.path.abspath(directory), 'bench-{0:d}.sqlite'.format(posts))
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        if reseed or not os.path.exists(path):
+            if os.path.exists(path):
+                os.remove(path)
+            db.create_all()
+            seed_database(users=max(posts // 100, 10), posts=posts, tags=50, seed=seed, progress=progress)
+        elif Post.query.count() != posts:
+            raise ValueError('{0!s} does not hold {1:d} posts, run with --reseed'.format(path, posts))
+        rng = random.Random(seed)
+        client = app.test_client()
+        results = {}
+        for name, route in _routes(rng):
+            _measure(client, route, warmup)
+            durations, queries, statuses = _measure(client, route, requests)
+            results[name] = {'p50': percentile(durations, 50), 'p95': percentile(durations, 95),
+                             'p99': percentile(durations, 99), 'queries': float(sum(queries)) / len(queries),
+                             'peak_memory': _peak_memory(client, route, min(requests, 5)), 'status': statuses}
+            if progress is not None:
+                progress('{0:d} posts {1!s}: p50 {2:.1f} ms, p95 {3:.1f} ms, {4:.1f} queries'.format(
+                    posts, name, results[name]['p50'] * 1000, results[name]['p95'] * 1000, results[name]['queries']))
+        db.session.remove()
+    return results
+
+
+def run(tiers=TIERS, directory='temp/bench', requests=50, reseed=False, seed=0, progress=None):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return {'python': platform.python_version(), 'requests': requests, 'seed': seed,
+            'tiers': dict((str(posts), run_tier(posts, directory, requests, reseed=reseed, seed=seed,
+                                                progress=progress))
+                          for posts in tiers)}
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return a message for every route metric more than ``threshold`` (a ratio) worse than in ``baseline``."""
+    regressions = []
+    for tier, routes in sorted(baseline.get('tiers', {}).items()):
+        for name, expected in sorted(routes.items()):
+            actual = results.get('tiers', {}).get(tier, {}).get(name)
+            if actual is None:
+                continue
+            for metric, tolerance in COMPARED:
+                if expected.get(metric) is None or actual.get(metric) is None:
+                    continue
+                limit = max(expected[metric] * (1 + threshold), expected[metric] + tolerance)
+                if actual[metric] > limit:
+                    regressions.append('{0!s} posts {1!s}: {2!s} {3:.4f} > {4:.4f} (baseline {5:.4f})'.format(
+                        tier, name, metric, actual[metric], limit, expected[metric]))
+    return regressions
+
+
+def save(results, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import os
+import hashlib
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+from flask.ext.login import current_user
+from flask.ext.sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect
+
+from app.conditional import make_conditional
+
+__author__ = 'zhangmm'
+
+
+class SimpleCache(object):
+    """In-process LRU cache bounded to ``max_size`` entries."""
+
+    def __init__(self, max_size=500):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()
+        self._epoch = '0'
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch = '0'
+
+    def __len__(self):
+        return len(self._entries)
+
+    def generation(self, group):
+        with self._lock:
+            return self._generations.get(group, self._epoch)
+
+    def bump(self, group):
+        with self._lock:
+            self._generations.pop(group, None)
+            self._generations[group] = uuid.uuid4().hex
+            if len(self._generations) > self.max_size:
+                self._generations.popitem(last=False)
+                # the forgotten group falls back to the epoch, which moves so that its pages stay unreachable
+                self._epoch = uuid.uuid4().hex
+
+
+class FileSystemCache(object):
+    """Cache shared between processes through pickled files in ``directory``."""
+
+    def __init__(self, directory, max_size=500):
+        self.directory = directory
+        self.max_size = max_size
+        self._generation_dir = os.path.join(directory, 'generations')
+        if not os.path.isdir(self._generation_dir):
+            os.makedirs(self._generation_dir)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _entries(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if not name.startswith('.') and name != 'generations']
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path, None)
+            return value
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        entries = self._entries()
+        if len(entries) >= self.max_size:
+            entries.sort(key=lambda name: os.path.getmtime(name))
+            for name in entries[:len(entries) - self.max_size + 1]:
+                self._remove(name)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self._path(key))
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for name in self._entries():
+            self._remove(name)
+        for name in os.listdir(self._generation_dir):
+            self._remove(os.path.join(self._generation_dir, name))
+
+    def __len__(self):
+        return len(self._entries())
+
+    def generation(self, group):
+        try:
+            with open(self._generation_path(group)) as f:
+                return f.read()
+        except (IOError, OSError):
+            return '0'
+
+    def bump(self, group):
+        fd, tmp = tempfile.mkstemp(dir=self._generation_dir, prefix='.')
+        with os.fdopen(fd, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.rename(tmp, self._generation_path(group))
+
+    def _generation_path(self, group):
+        return os.path.join(self._generation_dir, hashlib.sha1(group.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class VerifiedUserCache(object):
+    """Remembers which user a credential was verified for, until it expires.
+
+    Entries also record the user's password hash and are ignored once it
+    changes, so a password change revokes them in every process.
+    """
+
+    def __init__(self, max_size=1024):
+        self._entries = SimpleCache(max_size)
+
+    def get(self, key, load_user):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        user_id, password_hash, expires = entry
+        if expires <= time.time():
+            return None
+        user = load_user(user_id)
+        if user is None or user.password_hash != password_hash:
+            return None
+        return user
+
+    def set(self, key, user, expires):
+        self._entries.set(key, (user.id, user.password_hash, expires))
+
+    def clear(self):
+        self._entries.clear()
+
+
+class ModelCache(object):
+    """Detached copies of rows shared by every request of the process.
+
+    Rows are pickled when stored and merged into the caller's session
+    without a query when fetched, so each request gets its own instance.
+    Entries expire after ``ttl`` seconds and can be deleted explicitly when
+    the row changes. The cache lives in the memory of each process: a
+    deletion only reaches the process that made it, the others serve their
+    copy until it expires.
+    """
+
+    def __init__(self, max_size=256, ttl=300):
+        self._entries = SimpleCache(max_size)
+        self.ttl = ttl
+
+    def get(self, key, session):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return session.merge(pickle.loads(entry[1]), load=False)
+
+    def set(self, key, instance):
+        self._entries.set(key, (time.time() + self.ttl, pickle.dumps(instance, pickle.HIGHEST_PROTOCOL)))
+
+    def delete(self, *keys):
+        for key in keys:
+            self._entries.delete(key)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class _PageCacheState(object):
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+
+class PageCache(object):
+    """Full page cache for anonymous GET requests.
+
+    Pages are stored under their path and query string together with the
+    current generation of every group they depend on, so invalidating a
+    group (once the session that changed it has committed) makes all of its
+    pages unreachable without having to enumerate them.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_PAGE_CACHE', 'simple')
+        app.config.setdefault('ZBLOG_PAGE_CACHE_SIZE', 500)
+        app.config.setdefault('ZBLOG_PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page-cache'))
+        backend = None
+        if app.config['ZBLOG_PAGE_CACHE'] == 'simple' and app.config.get('ZBLOG_DEFER_RENDERING'):
+            # posts are rendered by 'manage.py worker', which could not invalidate this process' pages
+            raise RuntimeError('ZBLOG_DEFER_RENDERING needs ZBLOG_PAGE_CACHE set to filesystem or None')
+        if app.config['ZBLOG_PAGE_CACHE'] == 'simple':
+            backend = SimpleCache(app.config['ZBLOG_PAGE_CACHE_SIZE'])
+        elif app.config['ZBLOG_PAGE_CACHE'] == 'filesystem':
+            backend = FileSystemCache(app.config['ZBLOG_PAGE_CACHE_DIR'], app.config['ZBLOG_PAGE_CACHE_SIZE'])
+        app.extensions['page_cache'] = _PageCacheState(backend)
+
+    @property
+    def _state(self):
+        return current_app.extensions['page_cache']
+
+    def stats(self):
+        state = self._state
+        return {'hits': state.hits, 'misses': state.misses,
+                'size': len(state.backend) if state.backend is not None else 0}
+
+    def clear(self):
+        if self._state.backend is not None:
+            self._state.backend.clear()
+
+    def cached(self, *groups):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                state = self._state
+                if state.backend is None or request.method != 'GET' or current_user.is_authenticated or \
+                        '_flashes' in session:
+                    return f(*args, **kwargs)
+                names = [group.format(**kwargs) for group in groups]
+                key = '{0!s}|{1!s}'.format(request.full_path, ','.join(
+                    state.backend.generation(name) for name in names))
+                cached = state.backend.get(key)
+                if cached is not None:
+                    state.hits += 1
+                    response = current_app.response_class(cached[1], headers=cached[0])
+                    response.headers['X-Page-Cache'] = 'HIT'
+                    return make_conditional(response)
+                state.misses += 1
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough and not session.modified:
+                    headers = [(name, value) for name, value in response.headers
+                               if name in ('Content-Type', 'ETag', 'Last-Modified')]
+                    state.backend.set(key, (headers, response.get_data()))
+                response.headers['X-Page-Cache'] = 'MISS'
+                return response
+
+            return decorated_function
+
+        return decorator
+
+    def invalidate(self, *groups):
+        db_session = current_app.extensions['sqlalchemy'].db.session()
+        db_session.info.setdefault('page_cache_groups', set()).update(groups)
+
+
+# the columns of a user that cached pages show
+USER_PAGE_FIELDS = ('username', 'email', 'name', 'location', 'about_me', 'about_me_html', 'avatar_hash')
+
+
+def _changed(instance, names):
+    attrs = inspect(instance).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _invalidate_after_flush(db_session, flush_context):
+    # the pages of the rows written by any code path, not only by the views calling invalidate()
+    from app.models import User, Post, Tag, PostTags
+
+    groups = set()
+    created = set(db_session.new)
+    deleted = set(db_session.deleted)
+    for instance in db_session.new.union(db_session.dirty).union(db_session.deleted):
+        if isinstance(instance, Post):
+            groups.update(('posts', 'feeds'))
+            state = inspect(instance)
+            groups.update('post:' + url_title for url_title in
+                          [instance.url_title] + list(state.attrs.url_title.history.deleted or ()) if url_title)
+        elif isinstance(instance, (Tag, PostTags)):
+            groups.update(('posts', 'tags', 'feeds'))
+        elif isinstance(instance, User) and (instance in created or instance in deleted or
+                                             _changed(instance, USER_PAGE_FIELDS)):
+            # last_seen alone changes on every request and shows on no cached page
+            groups.add('users')
+    if groups:
+        db_session.info.setdefault('page_cache_groups', set()).update(groups)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _invalidate_after_commit(db_session):
+    groups = db_session.info.pop('page_cache_groups', None)
+    if groups and 'page_cache' in db_session.app.extensions:
+        backend = db_session.app.extensions['page_cache'].backend
+        if backend is not None:
+            for group in groups:
+                backend.bump(group)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _discard_after_rollback(db_session):
+    db_session.info.pop('page_cache_groups', None)
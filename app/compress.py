@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+from functools import wraps
+
+from flask import current_app, request, send_from_directory, safe_join
+
+from app.cache import SimpleCache
+from app.conditional import encoded_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__author__ = 'zhangmm'
+
+STATIC_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.ico')
+
+
+def gzip_compress(data, level=6):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip_compress(data, level)
+
+
+def _accepted(encoding):
+    return encoding in request.accept_encodings and request.accept_encodings[encoding] > 0
+
+
+def _encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class _CompressState(object):
+    def __init__(self, app):
+        self.enabled = app.config['ZBLOG_COMPRESS']
+        self.min_size = app.config['ZBLOG_COMPRESS_MIN_SIZE']
+        self.level = app.config['ZBLOG_COMPRESS_LEVEL']
+        self.mimetypes = set(app.config['ZBLOG_COMPRESS_MIMETYPES'])
+        self.cache = SimpleCache(app.config['ZBLOG_COMPRESS_CACHE_SIZE'])
+        self.hits = 0
+        self.misses = 0
+
+
+class Compress(object):
+    """Opt-in gzip (and brotli, when the module is installed) compression of responses.
+
+    Dynamic responses of a compressible type and at least
+    ``ZBLOG_COMPRESS_MIN_SIZE`` bytes are compressed after the request. The
+    compressed bodies are kept in an LRU cache keyed by a hash of the body,
+    so pages served from the page cache are only compressed once. Static
+    files are served from the ``.br``/``.gz`` copies written by
+    precompress_static() when they are up to date.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_COMPRESS', False)
+        app.config.setdefault('ZBLOG_COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('ZBLOG_COMPRESS_LEVEL', 6)
+        app.config.setdefault('ZBLOG_COMPRESS_MIMETYPES', ['text/html', 'text/css', 'text/plain', 'text/xml',
+                                                           'application/javascript', 'application/json',
+                                                           'application/xml', 'application/atom+xml'])
+        app.config.setdefault('ZBLOG_COMPRESS_CACHE_SIZE', 200)
+        state = _CompressState(app)
+        app.extensions['compress'] = state
+        if not state.enabled:
+            return
+        app.after_request(self._after_request)
+        if 'static' in app.view_functions:
+            app.view_functions['static'] = self._send_static(app.view_functions['static'])
+
+    def stats(self):
+        state = current_app.extensions['compress']
+        return {'hits': state.hits, 'misses': state.misses, 'size': len(state.cache)}
+
+    def _after_request(self, response):
+        state = current_app.extensions['compress']
+        if response.mimetype not in state.mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed or \
+                'Content-Encoding' in response.headers:
+            return response
+        encoding = next((encoding for encoding in _encodings() if _accepted(encoding)), None)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < state.min_size:
+            return response
+        key = '{0!s}:{1!s}'.format(encoding, hashlib.sha1(data).hexdigest())
+        compressed = state.cache.get(key)
+        if compressed is None:
+            state.misses += 1
+            compressed = _compress(data, encoding, state.level)
+            state.cache.set(key, compressed)
+        else:
+            state.hits += 1
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+        return response
+
+    def _send_static(self, send_static_file):
+        @wraps(send_static_file)
+        def decorated_function(filename):
+            folder = current_app.static_folder
+            source = safe_join(folder, filename)
+            for encoding in _encodings():
+                path = source + ('.br' if encoding == 'br' else '.gz')
+                if _accepted(encoding) and os.path.isfile(path) and os.path.isfile(source) and \
+                        os.path.getmtime(path) >= os.path.getmtime(source):
+                    response = send_from_directory(folder, os.path.relpath(path, folder),
+                                                   mimetype=mimetypes.guess_type(filename)[0] or
+                                                   'application/octet-stream')
+                    response.headers['Content-Encoding'] = encoding
+                    response.vary.add('Accept-Encoding')
+                    return response
+            response = send_static_file(filename)
+            if os.path.splitext(filename)[1] in STATIC_EXTENSIONS:
+                response.vary.add('Accept-Encoding')
+            return response
+
+        return decorated_function
+
+
+def precompress_static(folder, level=9, min_size=500):
+    """Write a ``.gz`` (and ``.br``) copy next to every compressible file in ``folder``
+    that has none or an outdated one. Returns the number of files written."""
+    count = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if os.path.splitext(name)[1] not in STATIC_EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            if os.path.getsize(source) < min_size:
+                continue
+            with open(source, 'rb') as f:
+                data = None
+                for encoding in _encodings():
+                    path = source + ('.br' if encoding == 'br' else '.gz')
+                    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+                        continue
+                    data = data if data is not None else f.read()
+                    with open(path, 'wb') as out:
+                        out.write(_compress(data, encoding, level))
+                    count += 1
+    return count
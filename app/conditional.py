@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import hashlib
+
+from flask import current_app, request, session, make_response
+from werkzeug.http import is_resource_modified
+
+__author__ = 'zhangmm'
+
+# content codings app.compress may apply
+ENCODINGS = ('gzip', 'br')
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _http_date(last_modified):
+    # HTTP dates have a resolution of one second
+    if last_modified is not None:
+        return last_modified.replace(microsecond=0)
+
+
+def encoded_etag(etag, encoding):
+    # a compressed body is another representation, so it gets a strong tag of its own
+    return '{0!s}-{1!s}'.format(etag, encoding)
+
+
+def _matching_etag(etag, last_modified):
+    # the tag of the representation the client holds, of any encoding, or None when it is out of date
+    variants = [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS] if etag else [etag]
+    for variant in variants:
+        if not is_resource_modified(request.environ, etag=variant, last_modified=_http_date(last_modified)):
+            return variant
+    return None
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the client already has this version, None otherwise."""
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+    matched = _matching_etag(etag, last_modified)
+    if matched is None:
+        return None
+    return set_validators(current_app.response_class(status=304), matched, last_modified)
+
+
+def make_conditional(response):
+    """Response.make_conditional() that also recognizes the tags of compressed copies."""
+    if request.method not in ('GET', 'HEAD'):
+        return response
+    etag = response.get_etag()[0]
+    matched = _matching_etag(etag, response.last_modified)
+    if matched is not None:
+        response.status_code = 304
+        if etag:
+            response.set_etag(matched)
+    return response
+
+
+def set_validators(rv, etag, last_modified=None):
+    response = make_response(rv)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_date(last_modified)
+    return response
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import logging
+import threading
+import weakref
+
+from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc, select
+from sqlalchemy.pool import QueuePool, StaticPool, SingletonThreadPool
+
+__author__ = 'zhangmm'
+
+logger = logging.getLogger('zblog.database')
+logger.addHandler(logging.NullHandler())
+
+# QueuePool settings a single connection pool does not accept
+POOL_SIZE_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+# busy_timeout goes first so that switching the journal mode waits for other connections
+PRAGMA_ORDER = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size')
+
+
+def _pragma_statements(pragmas):
+    names = [name for name in PRAGMA_ORDER if name in pragmas] + \
+            sorted(name for name in pragmas if name not in PRAGMA_ORDER)
+    return ['PRAGMA {0!s} = {1!s}'.format(name, pragmas[name]) for name in names]
+
+
+def _ping(connection, branch):
+    # pessimistic disconnect handling: a dead pooled connection is replaced before it is used
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as e:
+        if not e.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy with the engine settings of config.py.
+
+    SQLite connections run the ``ZBLOG_SQLITE_PRAGMAS`` as they are opened.
+    SQLite files get a new connection per checkout unless
+    ``SQLALCHEMY_POOL_SIZE`` is set, then they are pooled like server
+    databases, which ``SQLALCHEMY_POOL_SIZE``, ``SQLALCHEMY_MAX_OVERFLOW``,
+    ``SQLALCHEMY_POOL_RECYCLE`` and ``SQLALCHEMY_POOL_TIMEOUT`` tune and
+    ``ZBLOG_DB_PRE_PING`` checks before every checkout.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Database, self).__init__(*args, **kwargs)
+        self._configured = weakref.WeakSet()
+        self._configure_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_SQLITE_PRAGMAS', {})
+        app.config.setdefault('ZBLOG_DB_PRE_PING', False)
+        app.config.setdefault('ZBLOG_DB_REPORT', False)
+        super(Database, self).init_app(app)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(Database, self).apply_driver_hacks(app, info, options)
+        if info.drivername == 'sqlite' and options.get('pool_size') and 'poolclass' not in options:
+            # pysqlite would open file databases with a NullPool, which takes no size
+            options['poolclass'] = QueuePool
+            # pooled connections are handed from thread to thread, one at a time
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+        if options.get('poolclass') in (StaticPool, SingletonThreadPool):
+            # in-memory SQLite keeps one connection, these pools take no sizes
+            dropped = sorted(name for name in POOL_SIZE_OPTIONS if options.pop(name, None) is not None)
+            if dropped:
+                app.logger.warning('Ignoring {0!s} for the {1!s} of {2!r}'.format(
+                    ', '.join(dropped), options['poolclass'].__name__, info))
+
+    def get_engine(self, app, bind=None):
+        # engines are created again when the uri changes, each new one is set up once
+        with self._configure_lock:
+            engine = super(Database, self).get_engine(app, bind)
+            if engine not in self._configured:
+                self._configure(app, engine)
+                self._configured.add(engine)
+        return engine
+
+    @staticmethod
+    def _configure(app, engine):
+        if engine.dialect.name == 'sqlite':
+            statements = _pragma_statements(app.config['ZBLOG_SQLITE_PRAGMAS'])
+            if statements:
+                @event.listens_for(engine, 'connect')
+                def set_pragmas(dbapi_connection, connection_record):
+                    cursor = dbapi_connection.cursor()
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.close()
+        elif app.config['ZBLOG_DB_PRE_PING']:
+            event.listen(engine, 'engine_connect', _ping)
+
+    def report(self, app):
+        """The effective engine settings, as read back from a connection."""
+        engine = self.get_engine(app)
+        pool = engine.pool
+        settings = [('url', repr(engine.url)), ('pool', type(pool).__name__)]
+        if hasattr(pool, 'size'):
+            settings.extend([('pool_size', pool.size()), ('max_overflow', pool._max_overflow),
+                             ('pool_timeout', pool._timeout)])
+        settings.append(('pool_recycle', pool._recycle))
+        if engine.dialect.name == 'sqlite':
+            connection = engine.connect()
+            try:
+                for name in PRAGMA_ORDER:
+                    # some are not kept for an in-memory database, which returns no row for them
+                    result = connection.execute('PRAGMA {0!s}'.format(name))
+                    settings.append((name, result.scalar() if result.returns_rows else None))
+            finally:
+                connection.close()
+        else:
+            settings.append(('pre_ping', bool(app.config['ZBLOG_DB_PRE_PING'])))
+        return settings
+
+    def log_report(self, app):
+        settings = self.report(app)
+        for name, value in settings:
+            logger.info('{0!s}: {1!s}'.format(name, value))
+        requested = app.config['ZBLOG_SQLITE_PRAGMAS'].get('journal_mode')
+        effective = dict(settings).get('journal_mode')
+        if requested and effective and str(effective).lower() != str(requested).lower():
+            app.logger.warning('SQLite journal_mode is {0!s} instead of {1!s}'.format(effective, requested))
+        return settings
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
-from threading import Thread
 from functools import wraps
 
 from flask import abort
@@ -10,9 +9,22 @@ from flask.ext.login import current_user
 __author__ = 'zhangmm'
 
 
-def async(fun):
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_administrator():
+            abort(403)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def background(fun):
+    """Run ``fun`` on the shared executor; the wrapper returns a Future."""
+    from app import executor
+
+    @wraps(fun)
     def wrapper(*args, **kwargs):
-        thr = Thread(target=fun, args=args, kwargs=kwargs)
-        thr.start()
+        return executor.submit(fun, *args, **kwargs)
 
     return wrapper
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import atexit
+import threading
+import time
+from logging.handlers import SMTPHandler
+
+from flask import current_app
+
+__author__ = 'zhangmm'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _ExecutorState(object):
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config['ZBLOG_EXECUTOR_WORKERS']
+        self.queue_size = app.config['ZBLOG_EXECUTOR_QUEUE_SIZE']
+        self.timeout = app.config['ZBLOG_EXECUTOR_SUBMIT_TIMEOUT']
+        self.slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.closed = False
+        self.pending = 0
+        self.running = 0
+        self.counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    def get_pool(self):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('the executor has been shut down')
+            if self.pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.pool = ThreadPoolExecutor(self.workers)
+                atexit.register(self.shutdown)
+            return self.pool
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pool, self.pool = self.pool, None
+            self.closed = True
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+class Executor(object):
+    """A bounded pool of threads for work that should not hold up the request.
+
+    At most ``ZBLOG_EXECUTOR_WORKERS`` calls run at once and at most
+    ``ZBLOG_EXECUTOR_QUEUE_SIZE`` more wait for a thread; submitting beyond
+    that waits ``ZBLOG_EXECUTOR_SUBMIT_TIMEOUT`` seconds for room and then
+    raises QueueFull. Calls run inside an app context of the submitting
+    app and return a concurrent.futures Future. Queued calls are finished
+    before the process exits.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_EXECUTOR_WORKERS', 4)
+        app.config.setdefault('ZBLOG_EXECUTOR_QUEUE_SIZE', 100)
+        app.config.setdefault('ZBLOG_EXECUTOR_SUBMIT_TIMEOUT', 0)
+        app.extensions['executor'] = _ExecutorState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions['executor']
+
+    def submit(self, fn, *args, **kwargs):
+        state = self._state
+        if not self._acquire(state):
+            with state.lock:
+                state.counts['rejected'] += 1
+            raise QueueFull('{0:d} calls are already waiting'.format(state.queue_size))
+        submitted = time.time()
+
+        def run():
+            started = time.time()
+            with state.lock:
+                state.pending -= 1
+                state.running += 1
+                state.wait_time += started - submitted
+            try:
+                with state.app.app_context():
+                    return fn(*args, **kwargs)
+            except Exception:
+                with state.lock:
+                    state.counts['failed'] += 1
+                state.app.logger.exception('Background call {0!r} failed'.format(fn))
+                raise
+            finally:
+                with state.lock:
+                    state.running -= 1
+                    state.counts['completed'] += 1
+                    state.run_time += time.time() - started
+                state.slots.release()
+
+        try:
+            with state.lock:
+                state.pending += 1
+                state.counts['submitted'] += 1
+            future = state.get_pool().submit(run)
+        except Exception:
+            with state.lock:
+                state.pending -= 1
+            state.slots.release()
+            raise
+        future.add_done_callback(lambda future: self._cancelled(state, future))
+        return future
+
+    @staticmethod
+    def _cancelled(state, future):
+        # calls that ran have given their slot back already
+        if future.cancelled():
+            with state.lock:
+                state.pending -= 1
+            state.slots.release()
+
+    @staticmethod
+    def _acquire(state):
+        if not state.timeout:
+            return state.slots.acquire(False)
+        # python 2 semaphores take no timeout
+        deadline = time.time() + state.timeout
+        while not state.slots.acquire(False):
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, wait=True):
+        """Stop accepting calls and, with ``wait``, finish the queued ones."""
+        self._state.shutdown(wait)
+
+    def stats(self):
+        state = self._state
+        with state.lock:
+            stats = dict(state.counts)
+            stats.update({'pending': state.pending, 'running': state.running, 'wait_time': state.wait_time,
+                          'run_time': state.run_time})
+        return stats
+
+
+class BackgroundSMTPHandler(SMTPHandler):
+    """SMTPHandler that sends from the executor, so a failing request is not held up by the mail server."""
+
+    def emit(self, record):
+        from app import executor
+        try:
+            executor.submit(SMTPHandler.emit, self, record)
+        except (QueueFull, RuntimeError):
+            # outside an app context, or the executor is full or shut down
+            SMTPHandler.emit(self, record)
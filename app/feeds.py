@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+from xml.sax.saxutils import escape
+
+from flask import url_for
+from werkzeug.contrib.atom import AtomFeed
+
+__author__ = 'zhangmm'
+
+SITEMAP_HEADER = u'<?xml version="1.0" encoding="UTF-8"?>\n' \
+                 u'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+SITEMAP_FOOTER = u'</urlset>\n'
+
+
+def atom_feed(title, feed_url, url, posts, updated):
+    feed = AtomFeed(title, feed_url=feed_url, url=url, updated=updated)
+    for post in posts:
+        post_url = url_for('main.post', title=post.url_title, _external=True)
+        feed.add(post.title, post.body_html, content_type='html', url=post_url, id=post_url,
+                 author={'name': post.author.username if post.author else None},
+                 published=post.timestamp, updated=post.modified or post.timestamp)
+    return feed
+
+
+def _sitemap_url(loc, lastmod=None):
+    lines = [u'<url><loc>', escape(loc), u'</loc>']
+    if lastmod is not None:
+        lines.extend([u'<lastmod>', lastmod.strftime('%Y-%m-%dT%H:%M:%SZ'), u'</lastmod>'])
+    lines.append(u'</url>\n')
+    return u''.join(lines)
+
+
+def sitemap(chunk_size=1000):
+    """Yield sitemap.xml in pieces, reading the posts ``chunk_size`` at a time."""
+    from app.models import db, Post, Tag
+
+    yield SITEMAP_HEADER
+    for endpoint in ('main.index', 'main.posts', 'main.about_me'):
+        yield _sitemap_url(url_for(endpoint, _external=True))
+    last_id = 0
+    while True:
+        rows = db.session.query(Post.id, Post.url_title, Post.modified).filter(Post.id > last_id) \
+            .filter(Post.url_title.isnot(None)).order_by(Post.id).limit(chunk_size).all()
+        if not rows:
+            break
+        yield u''.join(_sitemap_url(url_for('main.post', title=row.url_title, _external=True), row.modified)
+                       for row in rows)
+        last_id = rows[-1].id
+    for name, modified in db.session.query(Tag.name, Tag.modified).filter(Tag.name.isnot(None)).order_by(Tag.id):
+        yield _sitemap_url(url_for('main.tag', name=name, _external=True), modified)
+    yield SITEMAP_FOOTER
+
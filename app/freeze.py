@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from flask import current_app, url_for
+
+from app.markup import RENDER_VERSION
+
+__author__ = 'zhangmm'
+
+MANIFEST = '.freeze-manifest.json'
+
+
+def _build_version(app):
+    # pages have to be rendered again when the templates or the markdown pipeline change
+    digest = hashlib.sha1(RENDER_VERSION.encode('utf-8'))
+    templates = os.path.join(app.root_path, app.template_folder)
+    for root, dirs, files in os.walk(templates):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, templates).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _pages():
+    from app.models import db, Post, Tag, User
+
+    pages = [(url_for('main.index'), ()), (url_for('main.posts'), ('posts',)),
+             (url_for('main.about_me'), ('about-me',))]
+    for title, in db.session.query(Post.url_title).filter(Post.url_title.isnot(None)).order_by(Post.id):
+        pages.append((url_for('main.post', title=title), ('post', title)))
+    for name, in db.session.query(Tag.name).filter(Tag.name.isnot(None)).order_by(Tag.id):
+        pages.append((url_for('main.tag', name=name), ('tag', name)))
+    for username, in db.session.query(User.username).filter(User.username.isnot(None)).order_by(User.id):
+        pages.append((url_for('main.user', username=username), ('user', username)))
+    return pages
+
+
+def _page_path(output, parts):
+    path = os.path.normpath(os.path.join(output, *(parts + ('index.html',))))
+    if not path.startswith(os.path.join(output, '')):
+        return None
+    return path
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+def _freeze_pages(app, output, pages):
+    results = []
+    client = app.test_client()
+    for url, parts, etag in pages:
+        path = _page_path(output, parts)
+        if path is None:
+            results.append((url, None, 'skipped'))
+            continue
+        headers = {'If-None-Match': '"{0!s}"'.format(etag)} if etag and os.path.exists(path) else {}
+        response = client.get(url, headers=headers)
+        if response.status_code == 304:
+            results.append((url, etag, 'unchanged'))
+        elif response.status_code == 200:
+            _write(path, response.get_data())
+            results.append((url, response.get_etag()[0], 'written'))
+        else:
+            results.append((url, None, 'skipped'))
+    return results
+
+
+def _freeze_batch(config_name, output, pages):
+    from app import create_app
+
+    return _freeze_pages(create_app(config_name), output, pages)
+
+
+def _copy_static(app, output):
+    target = os.path.join(output, 'static')
+    for root, dirs, files in os.walk(app.static_folder):
+        for name in files:
+            source = os.path.join(root, name)
+            path = os.path.join(target, os.path.relpath(source, app.static_folder))
+            if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+                continue
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            shutil.copy2(source, path)
+
+
+def freeze(output, config_name=None, workers=None, force=False):
+    """Render the public pages of the blog into ``output`` for a static web server.
+
+    Every post, tag and user page is written as ``<url>/index.html`` together
+    with the first page of the index and the post list, and the static files
+    are copied to ``output/static``. Requests with a query string (further
+    pages, search) have to be passed on to the application.
+
+    A manifest keeps the ETag of every page written, and the pages are
+    requested again with If-None-Match, so only pages whose posts, tags or
+    users changed since the last run are rendered. Pages that no longer exist
+    are removed. With ``config_name`` the pages are rendered in ``workers``
+    processes, each with its own application.
+    """
+    app = current_app._get_current_object()
+    output = os.path.abspath(output)
+    manifest_path = os.path.join(output, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    build = _build_version(app)
+    previous = manifest.get('pages', {})
+    etags = dict((url, page[0]) for url, page in previous.items()) \
+        if manifest.get('build') == build and not force else {}
+
+    pages = _pages()
+    items = [(url, parts, etags.get(url)) for url, parts in pages]
+    workers = workers or multiprocessing.cpu_count()
+    if config_name is None or workers < 2 or len(items) < 2:
+        results = _freeze_pages(app, output, items)
+    else:
+        from itertools import repeat
+        from concurrent.futures import ProcessPoolExecutor
+
+        batches = [items[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(workers) as executor:
+            results = [result for batch in
+                       executor.map(_freeze_batch, repeat(config_name), repeat(output), batches)
+                       for result in batch]
+
+    parts = dict(pages)
+    frozen = {}
+    counts = {'written': 0, 'unchanged': 0, 'skipped': 0, 'removed': 0}
+    for url, etag, outcome in results:
+        counts[outcome] += 1
+        if etag is not None:
+            frozen[url] = (etag, parts[url])
+    for url, (etag, page_parts) in previous.items():
+        if url not in frozen:
+            path = _page_path(output, tuple(page_parts))
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+                counts['removed'] += 1
+
+    _copy_static(app, output)
+    _write(manifest_path, json.dumps({'build': build, 'pages': frozen}, indent=1, sort_keys=True).encode('utf-8'))
+    return counts
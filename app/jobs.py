@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import json
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, and_
+
+__author__ = 'zhangmm'
+
+tasks = {}
+
+
+def task(name):
+    """Register a function as the job ``name``; its keyword arguments come from the job payload."""
+    def decorator(f):
+        tasks[name] = f
+        return f
+
+    return decorator
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """Add a job to the session; it is queued when the caller's transaction commits."""
+    from app.models import db, Job
+
+    job = Job(name=name, payload=json.dumps(payload), run_at=datetime.utcnow() + timedelta(seconds=delay),
+              max_attempts=max_attempts or current_app.config['ZBLOG_JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    return job
+
+
+@task('render_post')
+def render_post(post_id):
+    from app import page_cache
+    from app.markup import renderer, RENDER_VERSION
+    from app.models import db, Post
+
+    post = Post.query.options(db.undefer_group('content')).get(post_id)
+    if post is None:
+        return
+    post.body_html = renderer.render(post.body)
+    post.summary_html = renderer.summarize(post.body_html)
+    post.render_version = RENDER_VERSION
+    page_cache.invalidate('posts', 'users', 'post:' + post.url_title)
+    db.session.commit()
+
+
+def enqueue_deferred_renders(db_session, flush_context):
+    # after_flush: posts whose rendering was deferred by Post.on_change_body have an id by now
+    from app.models import Post, Job
+
+    rows = []
+    for post in db_session.new.union(db_session.dirty):
+        if isinstance(post, Post) and getattr(post, '_render_pending', False):
+            post._render_pending = False
+            rows.append({'name': 'render_post', 'payload': json.dumps({'post_id': post.id}), 'status': 'queued',
+                         'attempts': 0, 'max_attempts': db_session.app.config['ZBLOG_JOB_MAX_ATTEMPTS'],
+                         'run_at': datetime.utcnow(), 'created': datetime.utcnow()})
+    if rows:
+        db_session.execute(Job.__table__.insert(), rows)
+
+
+class Worker(object):
+    """Runs queued jobs with ``concurrency`` threads.
+
+    A job is leased by an UPDATE that only matches while it is still
+    available, so any number of workers can share the table. A lease lasts
+    ``ZBLOG_JOB_LEASE`` seconds; jobs of a worker that died are picked up
+    again once it expires. Failed jobs are retried after
+    ``ZBLOG_JOB_BACKOFF * 2 ** (attempts - 1)`` seconds, until they have
+    been tried ``max_attempts`` times, whether they raised or their lease
+    expired.
+    """
+
+    def __init__(self, app, concurrency=1, poll_interval=1.0):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = '{0!s}:{1:d}'.format(socket.gethostname(), os.getpid())
+        self.stopping = threading.Event()
+
+    def _available(self, now):
+        from app.models import Job
+
+        return and_(Job.attempts < Job.max_attempts,
+                    or_(and_(Job.status == 'queued', Job.run_at <= now),
+                        and_(Job.status == 'running', Job.lease_until < now)))
+
+    def lease(self):
+        from app.models import db, Job
+
+        now = datetime.utcnow()
+        # the worker died on its last attempt, the job would never be finished
+        db.session.execute(Job.__table__.update().where(and_(Job.status == 'running', Job.lease_until < now,
+                                                             Job.attempts >= Job.max_attempts))
+                           .values(status='failed', finished=now, lease_until=None,
+                                   last_error='the lease of the last attempt expired'))
+        db.session.commit()
+        candidates = [id for id, in db.session.query(Job.id).filter(self._available(now))
+                      .order_by(Job.run_at, Job.id).limit(self.concurrency * 2)]
+        for id in candidates:
+            result = db.session.execute(Job.__table__.update().where(and_(Job.id == id, self._available(now)))
+                                        .values(status='running', attempts=Job.attempts + 1, leased_by=self.name,
+                                                lease_until=now + timedelta(
+                                                    seconds=self.app.config['ZBLOG_JOB_LEASE'])))
+            db.session.commit()
+            if result.rowcount == 1:
+                return Job.query.get(id)
+        return None
+
+    def process(self, job):
+        from app.models import db, Job
+
+        id = job.id
+        f = tasks.get(job.name)
+        try:
+            if f is None:
+                raise LookupError('no task named {0!r}'.format(job.name))
+            f(**json.loads(job.payload or '{}'))
+        except Exception:
+            db.session.rollback()
+            job = Job.query.get(id)
+            job.last_error = traceback.format_exc()
+            if job.attempts < job.max_attempts:
+                job.status = 'queued'
+                job.run_at = datetime.utcnow() + timedelta(
+                    seconds=self.app.config['ZBLOG_JOB_BACKOFF'] * 2 ** (job.attempts - 1))
+            else:
+                job.status = 'failed'
+                job.finished = datetime.utcnow()
+            self.app.logger.exception('Job {0:d} ({1!s}) failed'.format(job.id, job.name))
+        else:
+            job = Job.query.get(id)
+            job.status = 'done'
+            job.finished = datetime.utcnow()
+        job.lease_until = None
+        db.session.commit()
+        return job.status
+
+    def _loop(self, once):
+        from app.models import db
+
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                job = self.lease()
+                if job is None:
+                    if once:
+                        break
+                    db.session.remove()
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                self.process(job)
+            db.session.remove()
+
+    def run(self, once=False):
+        """Process jobs until stop() is called, or with ``once`` until none is available."""
+        threads = [threading.Thread(target=self._loop, args=(once,)) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            # let the running jobs finish
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self.stopping.set()
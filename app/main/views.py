@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
-from flask import render_template, redirect, url_for, abort, flash, request, current_app
+from datetime import datetime
+from flask import render_template, redirect, url_for, abort, flash, request, current_app, stream_with_context
 from flask.ext.login import login_required, current_user
-from sqlalchemy import func
 from app.main import main
 from flask.ext.sqlalchemy import get_debug_queries
 from app.main.forms import EditProfileForm, PostForm, TagForm
-from app.models import db, User, Post, Tag, PostTags
+from app import page_cache, metrics, compress, executor, search as post_search
+from app.decorators import admin_required
+from app.markup import renderer
+from app.conditional import make_etag, not_modified, set_validators
+from app.feeds import atom_feed, sitemap as sitemap_chunks
+from app.pagination import Paginator
+from app.models import db, User, Post, Tag, PostTags, SiteVersion
 
 __author__ = 'zhangmm'
 
@@ -16,11 +22,26 @@ __author__ = 'zhangmm'
 def after_request(response):
     for query in get_debug_queries():
         if query.duration >= current_app.config['ZBLOG_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning('Slow query: {0!s}\nParameters: {1!s}\nDuration: {2!s}\nContext: {3!s}'.format(*
-                                       query.statement), query.parameters, query.duration, query.context)
+            current_app.logger.warning('Slow query: {0!s}\nParameters: {1!s}\nDuration: {2!s}\nContext: {3!s}'.format(
+                query.statement, query.parameters, query.duration, query.context))
     return response
 
 
+@main.route('/metrics', endpoint='metrics')
+@login_required
+@admin_required
+def metrics_view():
+    gauges = {}
+    for prefix, title, stats in (('zblog_page_cache', 'Page cache', page_cache.stats()),
+                                 ('zblog_markdown_cache', 'Markdown cache', renderer.stats()),
+                                 ('zblog_compress_cache', 'Compressed body cache', compress.stats())):
+        for key in ('hits', 'misses', 'size'):
+            gauges['{0!s}_{1!s}'.format(prefix, key)] = ('{0!s} {1!s}.'.format(title, key), stats[key])
+    for key, value in executor.stats().items():
+        gauges['zblog_executor_{0!s}'.format(key)] = ('Background calls {0!s}.'.format(key.replace('_', ' ')), value)
+    return current_app.response_class(metrics.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+
 @main.route('/shutdown')
 def server_shutdown():
     if not current_app.testing:
@@ -33,41 +54,57 @@ def server_shutdown():
 
 
 @main.route('/', methods=['GET', 'POST'])
+@page_cache.cached('posts', 'tags')
 def index():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['ZBLOG_POSTS_PER_PAGE'], error_out=False)
+    # a listing follows from its URL and the site version
+    version, last_modified = SiteVersion.current()
+    etag = make_etag(version, current_user.get_id())
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator.from_request(current_app.config['ZBLOG_POSTS_PER_PAGE'])
+    pagination = paginator.paginate(Post.listing(Post.query))
     posts = pagination.items
-    tags = Tag.query.all()
-    return render_template('index.html', posts=posts, pagination=pagination, tags=tags, show_all=False)
+    tags = Tag.cloud()
+    return set_validators(render_template('index.html', posts=posts, pagination=pagination, tags=tags,
+                                          show_all=False), etag, last_modified)
 
 
 @main.route('/user/<username>')
 def user(username):
-    user = User.query.filter_by(username=username).first()
+    user = User.get_cached(username=username)
     if user is None:
         abort(404)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['ZBLOG_POSTS_PER_PAGE'], error_out=False)
+    version, last_modified = SiteVersion.current()
+    etag = make_etag(version, user.username, user.name, user.location, user.email, user.about_me_html,
+                     user.last_seen, current_user.get_id())
+    last_modified = max([m for m in (last_modified, user.last_seen) if m is not None] or [None])
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator.from_request(current_app.config['ZBLOG_POSTS_PER_PAGE'])
+    pagination = paginator.paginate(Post.listing(user.posts))
     posts = pagination.items
-    return render_template('user.html', user=user, posts=posts, pagination=pagination)
+    return set_validators(render_template('user.html', user=user, posts=posts, pagination=pagination),
+                          etag, last_modified)
 
 
 @main.route('/user/<username>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile(username):
-    user = User.query.filter_by(username=username).first()
+    user = User.get_cached(username=username)
     if not user:
         abort(404)
     form = EditProfileForm(user=user)
     if form.validate_on_submit():
+        user.uncache()
         user.email = form.email.data
         user.username = form.username.data
         user.name = form.name.data
         user.location = form.location.data
         user.about_me = form.about_me.data
         db.session.add(user)
+        page_cache.invalidate('users', 'posts')
         flash('个人信息已更新.')
         return redirect(url_for('.user', username=user.username))
     form.email.data = user.email
@@ -79,20 +116,33 @@ def edit_profile(username):
 
 
 @main.route('/post/<title>')
+@page_cache.cached('post:{title}', 'tags', 'users')
 def post(title):
-    post = Post.query.filter_by(url_title=title).first()
+    version, last_modified = Post.detail_version(Post.url_title == title)
+    if version is None:
+        abort(404)
+    etag = make_etag(version, current_user.get_id())
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    post = Post.query.options(db.undefer_group('content')).filter_by(url_title=title).first()
     if not post:
         abort(404)
-    return render_template('post.html', posts=[post, ], show_all=True)
+    return set_validators(render_template('post.html', posts=[post, ], show_all=True), etag, last_modified)
 
 
 @main.route('/posts')
+@page_cache.cached('posts', 'tags')
 def posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['ZBLOG_POSTS_PER_PAGE'], error_out=False)
+    version, last_modified = SiteVersion.current()
+    etag = make_etag(version, current_user.get_id())
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator.from_request(current_app.config['ZBLOG_POSTS_PER_PAGE'])
+    pagination = paginator.paginate(Post.listing(Post.query))
     posts = pagination.items
-    return render_template('posts.html', posts=posts, pagination=pagination)
+    return set_validators(render_template('posts.html', posts=posts, pagination=pagination), etag, last_modified)
 
 
 @main.route('/post/new', methods=['GET', 'POST'])
@@ -105,11 +155,12 @@ def new_post():
         post.body = form.body.data
         post.author = current_user
         db.session.add(post)
-        db.session.commit()
+        db.session.flush()
         tag_ids = form.tags.data
         for tag_id in tag_ids:
             post_tags = PostTags(post_id=post.id, tag_id=tag_id)
             db.session.add(post_tags)
+        page_cache.invalidate('posts')
         flash('文章已发布.')
         return redirect(url_for('.post', title=post.url_title))
     return render_template('edit_post.html', form=form, is_new=True)
@@ -125,15 +176,18 @@ def edit_post(title):
         abort(403)
     form = PostForm()
     if form.validate_on_submit():
+        page_cache.invalidate('posts', 'post:' + post.url_title)
         post.title = form.title.data
         post.body = form.body.data
+        post.modified = datetime.utcnow()
         db.session.add(post)
-        for tag in post.tags:
-            db.session.delete(tag)
+        for post_tag in post.post_tags:
+            db.session.delete(post_tag)
         tag_ids = form.tags.data
         for tag_id in tag_ids:
             post_tags = PostTags(post_id=post.id, tag_id=tag_id)
             db.session.add(post_tags)
+        page_cache.invalidate('post:' + post.url_title)
         flash('文章已更新.')
         return redirect(url_for('.post', title=post.url_title))
     form.title.data = post.title
@@ -155,21 +209,79 @@ def delete_post(title):
             abort(404)
         db.session.delete(post)
         PostTags.query.filter_by(post_id=post.id).delete()
+        page_cache.invalidate('posts', 'post:' + post.url_title)
         flash('文章已删除.')
         return redirect(url_for('.posts'))
     abort(404)
 
 
 @main.route('/tag/<name>')
+@page_cache.cached('posts', 'tags')
 def tag(name):
     query = Post.query.join(PostTags, PostTags.post_id == Post.id) \
         .join(Tag, Tag.id == PostTags.tag_id).filter(Tag.name == name)
-    page = request.args.get('page', 1, type=int)
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['ZBLOG_POSTS_PER_PAGE'], error_out=False)
+    version, last_modified = SiteVersion.current()
+    etag = make_etag(version, current_user.get_id())
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator.from_request(current_app.config['ZBLOG_POSTS_PER_PAGE'])
+    pagination = paginator.paginate(Post.listing(query))
     posts = pagination.items
-    tags = Tag.query.all()
-    return render_template('index.html', posts=posts, pagination=pagination, tags=tags, show_all=False)
+    tags = Tag.cloud()
+    return set_validators(render_template('index.html', posts=posts, pagination=pagination, tags=tags,
+                                          show_all=False), etag, last_modified)
+
+
+def _feed(query, title, feed_url, url):
+    version, last_modified = SiteVersion.current()
+    etag = make_etag('feed', version)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    paginator = Paginator(current_app.config['ZBLOG_FEED_SIZE'])
+    posts = paginator.paginate(Post.listing(query, content=True)).items
+    feed = atom_feed(title, feed_url, url, posts, last_modified)
+    return set_validators(feed.get_response(), etag, last_modified)
+
+
+@main.route('/feed.atom')
+@page_cache.cached('feeds', 'users')
+def feed():
+    return _feed(Post.query, current_app.config['ZBLOG_TITLE'], url_for('.feed', _external=True),
+                 url_for('.index', _external=True))
+
+
+@main.route('/tag/<name>/feed.atom')
+@page_cache.cached('feeds', 'users')
+def tag_feed(name):
+    if Tag.query.filter_by(name=name).first() is None:
+        abort(404)
+    query = Post.query.join(PostTags, PostTags.post_id == Post.id) \
+        .join(Tag, Tag.id == PostTags.tag_id).filter(Tag.name == name)
+    return _feed(query, u'{0!s} - {1!s}'.format(name, current_app.config['ZBLOG_TITLE']),
+                 url_for('.tag_feed', name=name, _external=True), url_for('.tag', name=name, _external=True))
+
+
+@main.route('/sitemap.xml')
+def sitemap():
+    version, last_modified = SiteVersion.current()
+    etag = make_etag('sitemap', version)
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    chunks = sitemap_chunks(current_app.config['ZBLOG_SITEMAP_CHUNK_SIZE'])
+    return set_validators(current_app.response_class(stream_with_context(chunks), mimetype='application/xml'),
+                          etag, last_modified)
+
+
+@main.route('/search')
+@page_cache.cached('posts', 'tags')
+def search():
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    pagination = post_search.query(q, page, current_app.config['ZBLOG_POSTS_PER_PAGE'])
+    return render_template('search.html', q=q, posts=pagination.items, pagination=pagination, show_all=False)
 
 
 @main.route('/tags', methods=['GET', 'POST'])
@@ -180,10 +292,10 @@ def tags():
     if form.validate_on_submit():
         tag.name = form.name.data
         db.session.add(tag)
+        page_cache.invalidate('tags')
         flash('标签已添加')
     form.name.data = tag.name
-    tags = db.session.query(Tag.name, func.count(Tag.name).label('post_count')).join(Tag.posts).group_by(
-        Tag.name).all()
+    tags = Tag.cloud()
     return render_template('tags.html', tags=tags, form=form)
 
 
@@ -197,6 +309,7 @@ def edit_tag(name):
     if form.validate_on_submit():
         tag.name = form.name.data
         db.session.add(tag)
+        page_cache.invalidate('tags')
         flash('标签已更新.')
         return redirect(url_for('tag'))
     form.name.data = tag.name
@@ -217,12 +330,18 @@ def delete_tag(name):
             abort(404)
         db.session.delete(tag)
         PostTags.query.filter_by(tag_id=tag.id).delete()
+        page_cache.invalidate('tags')
         flash('标签已删除.')
         return redirect(url_for('.tags'))
     abort(404)
 
 
 @main.route('/about-me')
+@page_cache.cached('users')
 def about_me():
-    user = User.query.first()
-    return render_template('about_me.html', user=user)
+    user = User.get_cached(first=True)
+    etag = make_etag(user.id if user else None, user.about_me_html if user else None, current_user.get_id())
+    response = not_modified(etag)
+    if response:
+        return response
+    return set_validators(render_template('about_me.html', user=user), etag)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import difflib
+import hashlib
+import multiprocessing
+import threading
+import time
+
+import bleach
+import markdown as markdown_module
+from markdown import markdown
+from six.moves.html_parser import HTMLParser
+
+from app.cache import SimpleCache
+from app.metrics import record
+
+__author__ = 'zhangmm'
+
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                'h1', 'h2', 'h3', 'p']
+
+# changes whenever the output of render() may change, so stored html can be re-rendered
+RENDER_VERSION = hashlib.sha1(repr((ALLOWED_TAGS, getattr(markdown_module, 'version', None),
+                                    getattr(bleach, '__version__', None))).encode('utf-8')).hexdigest()[:16]
+
+
+def render(value):
+    if value is None:
+        return None
+    return bleach.linkify(bleach.clean(markdown(value, output_format='html'), tags=ALLOWED_TAGS, strip=True))
+
+
+class _Truncator(HTMLParser):
+    void_tags = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr')
+
+    def __init__(self, length):
+        HTMLParser.__init__(self)
+        # keep entities as written; they are counted as one character each
+        self.convert_charrefs = False
+        self.remaining = length
+        self.output = []
+        self.open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.remaining > 0:
+            self.output.append(self.get_starttag_text())
+            if tag not in self.void_tags:
+                self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.remaining > 0:
+            self.output.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.remaining > 0 and tag in self.open_tags:
+            while self.open_tags:
+                open_tag = self.open_tags.pop()
+                self.output.append('</{0!s}>'.format(open_tag))
+                if open_tag == tag:
+                    break
+
+    def handle_data(self, data):
+        if self.remaining > 0:
+            self.output.append(data[:self.remaining])
+            self.remaining -= len(data)
+
+    def handle_entityref(self, name):
+        self.handle_reference('&{0!s};'.format(name))
+
+    def handle_charref(self, name):
+        self.handle_reference('&#{0!s};'.format(name))
+
+    def handle_reference(self, text):
+        if self.remaining > 0:
+            self.output.append(text)
+            self.remaining -= 1
+
+    def result(self):
+        self.close()
+        return ''.join(self.output + ['</{0!s}>'.format(tag) for tag in reversed(self.open_tags)])
+
+
+def summarize(html, length=300):
+    """Cut html after ``length`` characters of text, closing every tag left open."""
+    if html is None:
+        return None
+    truncator = _Truncator(length)
+    truncator.feed(html)
+    return truncator.result()
+
+
+class MarkdownRenderer(object):
+    """Markdown to sanitized html, with an LRU cache keyed by a hash of the source."""
+
+    def __init__(self, max_size=1024, summary_length=300):
+        self.cache = SimpleCache(max_size)
+        self.summary_length = summary_length
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(value):
+        return '{0!s}:{1!s}'.format(RENDER_VERSION, hashlib.sha1(value.encode('utf-8')).hexdigest())
+
+    def render(self, value):
+        if value is None:
+            return None
+        key = self._key(value)
+        html = self.cache.get(key)
+        if html is not None:
+            with self._lock:
+                self.hits += 1
+            return html
+        start = time.time()
+        html = render(value)
+        record('markdown', time.time() - start)
+        self.cache.set(key, html)
+        with self._lock:
+            self.misses += 1
+        return html
+
+    def summarize(self, html):
+        return summarize(html, self.summary_length)
+
+    def prime(self, values, workers=None):
+        """Render the values missing from the cache in a pool of ``workers`` processes.
+
+        Later calls to render() for these values are cache hits, as long as
+        the cache is larger than the number of values.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or multiprocessing.cpu_count()
+        missing = {}
+        for value in values:
+            if value:
+                key = self._key(value)
+                if key not in missing and self.cache.get(key) is None:
+                    missing[key] = value
+        if workers < 2 or len(missing) < 2:
+            return 0
+        items = list(missing.items())
+        batches = [items[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(workers) as executor:
+            for batch in executor.map(_render_values, batches):
+                for key, html in batch:
+                    self.cache.set(key, html)
+        return len(missing)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache),
+                'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+renderer = MarkdownRenderer()
+
+
+def _render_values(batch):
+    return [(key, render(value)) for key, value in batch]
+
+
+def _render_batch(batch, summary_length):
+    results = []
+    for id, body in batch:
+        html = render(body)
+        results.append((id, html, summarize(html, summary_length)))
+    return results
+
+
+def rerender_posts(chunk_size=200, workers=None, dry_run=False, everything=False, start_after=0, progress=None):
+    """Re-render ``body_html`` and ``summary_html`` of posts rendered by an older pipeline, or of all posts,
+    and then ``about_me_html`` of the user profiles in the same way.
+
+    Posts are read in id order, ``chunk_size`` at a time, rendered in a pool
+    of ``workers`` processes and written back with one executemany UPDATE per
+    chunk, committed as it goes. Because finished posts carry the current
+    RENDER_VERSION, running it again resumes where an interrupted run stopped;
+    ``start_after`` skips ids explicitly. Posts whose html changed get a new
+    ``modified`` time, so their validators change too. With ``dry_run``
+    nothing is written and a diff of every changed post is passed to
+    ``progress`` instead, which also receives a line after every chunk.
+    """
+    from itertools import repeat
+    from concurrent.futures import ProcessPoolExecutor
+    from sqlalchemy import or_, bindparam
+    from app import db, page_cache
+    from app.models import Post
+
+    from datetime import datetime
+
+    progress = progress or (lambda message: None)
+    workers = workers or multiprocessing.cpu_count()
+    query = db.session.query(Post.id, Post.body, Post.body_html, Post.modified)
+    if not everything:
+        query = query.filter(or_(Post.render_version.is_(None), Post.render_version != RENDER_VERSION,
+                                 Post.summary_html.is_(None)))
+    total = query.filter(Post.id > start_after).count()
+    table = Post.__table__
+    statement = table.update().where(table.c.id == bindparam('post_id')) \
+        .values(body_html=bindparam('html'), summary_html=bindparam('summary'), render_version=RENDER_VERSION,
+                modified=bindparam('modified'))
+    done = changed = 0
+    last_id = start_after
+    with ProcessPoolExecutor(workers) as executor:
+        while True:
+            rows = query.filter(Post.id > last_id).order_by(Post.id).limit(chunk_size).all()
+            if not rows:
+                break
+            batches = [[(row.id, row.body) for row in rows[i::workers]] for i in range(workers)]
+            rendered = dict((id, (html, summary)) for batch in
+                            executor.map(_render_batch, batches, repeat(renderer.summary_length))
+                            for id, html, summary in batch)
+            now = datetime.utcnow()
+            updates = []
+            chunk_changed = 0
+            for row in rows:
+                html, summary = rendered[row.id]
+                modified = row.modified
+                if html != row.body_html:
+                    chunk_changed += 1
+                    modified = now
+                    if dry_run:
+                        for line in difflib.unified_diff((row.body_html or '').splitlines(), (html or '').splitlines(),
+                                                         'post {0:d} (stored)'.format(row.id),
+                                                         'post {0:d} (rendered)'.format(row.id), lineterm=''):
+                            progress(line)
+                # modified is given for every row, or its onupdate would touch the unchanged ones too
+                updates.append({'post_id': row.id, 'html': html, 'summary': summary, 'modified': modified})
+            if not dry_run:
+                if chunk_changed:
+                    # summaries show on every listing, the full html on the post pages (group 'tags')
+                    page_cache.invalidate('posts', 'tags', 'users', 'feeds')
+                db.session.execute(statement, updates)
+                db.session.commit()
+            changed += chunk_changed
+            done += len(rows)
+            last_id = rows[-1].id
+            progress('{0:d}/{1:d} posts, {2:d} changed, last id {3:d}'.format(done, total, changed, last_id))
+
+    users, users_changed = _rerender_users(chunk_size, dry_run, everything, progress)
+    return done + users, changed + users_changed
+
+
+def _rerender_users(chunk_size, dry_run, everything, progress):
+    # profiles are few and short, they are rendered in this process
+    from sqlalchemy import or_, bindparam
+    from app import db, page_cache, user_cache
+    from app.models import User
+
+    query = db.session.query(User.id, User.about_me, User.about_me_html).filter(User.about_me.isnot(None))
+    if not everything:
+        query = query.filter(or_(User.about_me_render_version.is_(None),
+                                 User.about_me_render_version != RENDER_VERSION))
+    table = User.__table__
+    statement = table.update().where(table.c.id == bindparam('user_id')) \
+        .values(about_me_html=bindparam('html'), about_me_render_version=RENDER_VERSION)
+    done = changed = 0
+    last_id = 0
+    while True:
+        rows = query.filter(User.id > last_id).order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            html = render(row.about_me)
+            if html != row.about_me_html:
+                changed += 1
+                if dry_run:
+                    for line in difflib.unified_diff((row.about_me_html or '').splitlines(),
+                                                     (html or '').splitlines(), 'user {0:d} (stored)'.format(row.id),
+                                                     'user {0:d} (rendered)'.format(row.id), lineterm=''):
+                        progress(line)
+            updates.append({'user_id': row.id, 'html': html})
+        if not dry_run:
+            db.session.execute(statement, updates)
+            db.session.commit()
+        done += len(rows)
+        last_id = rows[-1].id
+    if changed and not dry_run:
+        user_cache.clear()
+        page_cache.invalidate('users')
+        db.session.commit()
+    return done, changed
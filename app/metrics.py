@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import json
+import logging
+import threading
+import time
+
+from flask import current_app, request, g, has_request_context
+from flask.ext.sqlalchemy import get_debug_queries
+from jinja2 import Template
+
+__author__ = 'zhangmm'
+
+logger = logging.getLogger('zblog.requests')
+logger.addHandler(logging.NullHandler())
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+# name, help, buckets, key of the per-request sample
+HISTOGRAMS = (
+    ('zblog_request_duration_seconds', 'Time spent handling the request.', TIME_BUCKETS, 'duration'),
+    ('zblog_request_queries', 'SQL queries issued by the request.', COUNT_BUCKETS, 'queries'),
+    ('zblog_request_db_seconds', 'Time spent in SQL queries.', TIME_BUCKETS, 'db_time'),
+    ('zblog_request_template_seconds', 'Time spent rendering templates.', TIME_BUCKETS, 'template_time'),
+    ('zblog_request_markdown_seconds', 'Time spent rendering Markdown.', TIME_BUCKETS, 'markdown_time'),
+    ('zblog_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS, 'size'),
+)
+
+
+def record(name, seconds):
+    """Add ``seconds`` to the ``name`` timer of the current request, if there is one."""
+    if has_request_context():
+        timers = g.get('_metrics_timers')
+        if timers is not None:
+            timers[name] = timers.get(name, 0.0) + seconds
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        if not has_request_context():
+            return Template.render(self, *args, **kwargs)
+        depth = g.get('_metrics_template_depth', 0)
+        g._metrics_template_depth = depth + 1
+        start = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            g._metrics_template_depth = depth
+            if not depth:
+                record('template', time.time() - start)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _MetricsState(object):
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """Per-request instrumentation.
+
+    Every request measures its duration, the number and duration of its SQL
+    queries (from ``SQLALCHEMY_RECORD_QUERIES``), the time spent rendering
+    templates and Markdown, and the size of the response. The sample is
+    logged as JSON on the ``zblog.requests`` logger, returned as ``X-*``
+    headers when ``ZBLOG_METRICS_HEADERS`` is set, and
+    added to per-endpoint histograms that prometheus() renders. The
+    histograms belong to the process.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_METRICS_HEADERS', app.debug)
+        app.extensions['metrics'] = _MetricsState()
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g._metrics_start = time.time()
+        g._metrics_timers = {}
+        # recorded queries belong to the app context, which may outlive the request
+        g._metrics_query_offset = len(get_debug_queries())
+
+    def _after_request(self, response):
+        start = g.get('_metrics_start')
+        if start is None:
+            return response
+        queries = get_debug_queries()[g.get('_metrics_query_offset', 0):]
+        timers = g.get('_metrics_timers') or {}
+        if response.direct_passthrough or response.is_streamed:
+            size = response.content_length or 0
+        else:
+            size = len(response.get_data())
+        sample = {'endpoint': request.endpoint or 'unknown', 'method': request.method,
+                  'status': response.status_code, 'duration': time.time() - start, 'queries': len(queries),
+                  'db_time': sum(query.duration for query in queries),
+                  'template_time': timers.get('template', 0.0), 'markdown_time': timers.get('markdown', 0.0),
+                  'size': size}
+        self.observe(sample)
+        logger.info(json.dumps(sample, sort_keys=True))
+        if current_app.config['ZBLOG_METRICS_HEADERS']:
+            response.headers['X-Request-Time'] = '{0:.6f}'.format(sample['duration'])
+            response.headers['X-Query-Count'] = str(sample['queries'])
+            response.headers['X-Query-Time'] = '{0:.6f}'.format(sample['db_time'])
+            response.headers['X-Template-Time'] = '{0:.6f}'.format(sample['template_time'])
+            response.headers['X-Markdown-Time'] = '{0:.6f}'.format(sample['markdown_time'])
+            response.headers['X-Response-Size'] = str(size)
+        return response
+
+    def observe(self, sample):
+        state = current_app.extensions['metrics']
+        with state.lock:
+            for name, help, buckets, key in HISTOGRAMS:
+                histogram = state.histograms.get((name, sample['endpoint']))
+                if histogram is None:
+                    histogram = state.histograms[(name, sample['endpoint'])] = Histogram(buckets)
+                histogram.observe(sample[key])
+
+    def prometheus(self, gauges=None):
+        """The histograms, and the ``gauges`` given as {name: (help, value)}, in the Prometheus text format."""
+        state = current_app.extensions['metrics']
+        lines = []
+        with state.lock:
+            for name, help, buckets, key in HISTOGRAMS:
+                lines.append('# HELP {0!s} {1!s}'.format(name, help))
+                lines.append('# TYPE {0!s} histogram'.format(name))
+                for (histogram_name, endpoint), histogram in sorted(state.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    label = 'endpoint="{0!s}"'.format(_escape(endpoint))
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('{0!s}_bucket{{{1!s},le="{2!s}"}} {3:d}'.format(name, label, bound, count))
+                    lines.append('{0!s}_bucket{{{1!s},le="+Inf"}} {2:d}'.format(name, label, histogram.count))
+                    lines.append('{0!s}_sum{{{1!s}}} {2!s}'.format(name, label, _format_number(histogram.sum)))
+                    lines.append('{0!s}_count{{{1!s}}} {2:d}'.format(name, label, histogram.count))
+        for name, (help, value) in sorted((gauges or {}).items()):
+            lines.append('# HELP {0!s} {1!s}'.format(name, help))
+            lines.append('# TYPE {0!s} gauge'.format(name))
+            lines.append('{0!s} {1!s}'.format(name, _format_number(value)))
+        return '\n'.join(lines) + '\n'
@@ -8,11 +8,16 @@ from sqlalchemy import UniqueConstraint
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app, request, url_for
-from markdown import markdown
-import bleach
+from flask.ext.sqlalchemy import SignallingSession
+from markupsafe import escape
 import pinyin
-from app import db, login_manager
+from app import db, login_manager, presence, user_cache
 from app.exceptions import ValidationError
+from app.search import on_change_post
+from app.jobs import enqueue_deferred_renders
+from app.markup import renderer, RENDER_VERSION
+from app.presence import on_load_user
+from app.cache import VerifiedUserCache
 
 __author__ = 'zhangmm'
 
@@ -44,6 +49,7 @@ class Tag(db.Model):
     __tablename__ = 'tag'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(32))
+    modified = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     posts = db.relationship('PostTags', foreign_keys=[PostTags.tag_id], backref=db.backref('tags', lazy='joined'),
                             lazy='dynamic', cascade='all, delete-orphan')
@@ -59,8 +65,17 @@ class Tag(db.Model):
             db.session.add(t)
             db.session.commit()
 
+    @staticmethod
+    def cloud(*ids):
+        query = db.session.query(Tag.name, db.func.count(PostTags.post_id).label('post_count')) \
+            .outerjoin(PostTags, PostTags.tag_id == Tag.id).group_by(Tag.id, Tag.name)
+        if ids:
+            query = query.filter(Tag.id.in_(ids))
+        return query.order_by(Tag.name).all()
+
     def to_json(self):
-        json_post = {'name': self.name, 'post_count': self.posts.count()}
+        post_count = Tag.cloud(self.id)[0].post_count if self.id is not None else 0
+        json_post = {'name': self.name, 'post_count': post_count}
         return json_post
 
     @staticmethod
@@ -79,36 +94,67 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
     url_title = db.Column(db.String(64), index=True)
-    body = db.Column(db.Text)
-    body_html = db.Column(db.Text)
+    # listings only need the summary, the full text is loaded on demand
+    body = db.deferred(db.Column(db.Text), group='content')
+    body_html = db.deferred(db.Column(db.Text), group='content')
+    summary_html = db.Column(db.Text)
+    render_version = db.Column(db.String(16))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    modified = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
     post_tags = db.relationship('PostTags', foreign_keys=[PostTags.post_id], backref=db.backref('posts', lazy='joined'),
                                 lazy='dynamic', cascade='all, delete-orphan')
+    tags = db.relationship('Tag', secondary='post_tag', viewonly=True)
 
-    @property
-    def tags(self):
-        return Tag.query.join(PostTags, PostTags.tag_id == Tag.id).filter(PostTags.post_id == self.id)
+    @staticmethod
+    def listing(query, content=False):
+        query = query.options(db.subqueryload(Post.tags), db.joinedload(Post.author))
+        if content:
+            query = query.options(db.undefer_group('content'))
+        return query
+
+    @staticmethod
+    def detail_version(*criterion):
+        row = db.session.query(Post.id, Post.modified, User.username) \
+            .outerjoin(User, User.id == Post.author_id).filter(*criterion).first()
+        if row is None:
+            return None, None
+        tags = db.session.query(Tag.name, Tag.modified).join(PostTags, PostTags.tag_id == Tag.id) \
+            .filter(PostTags.post_id == row.id).order_by(Tag.name).all()
+        # the author's name is shown too, which only moves the site version
+        modified = [row.modified, SiteVersion.current()[1]] + [tag.modified for tag in tags]
+        return (tuple(row), tuple(tuple(tag) for tag in tags)), max([m for m in modified if m is not None] or [None])
 
     @property
     def summary(self):
-        if self.body_html:
-            return self.body_html[0:300]
-        if self.body:
-            return self.body[0:300]
+        # only summary_html is loaded by listings, the text columns would cost a query per post
+        if self.summary_html:
+            return self.summary_html
         return 'possible no content!'
 
     @staticmethod
     def on_change_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(
-            bleach.clean(markdown(value, output_format='html'), tags=allowed_tags, strip=True))
+        if value == oldvalue and target.body_html is not None and target.summary_html is not None and \
+                target.render_version == RENDER_VERSION:
+            return
+        if current_app.config.get('ZBLOG_DEFER_RENDERING'):
+            # rendered by the render_post job; until then the escaped raw body is shown
+            target.body_html = target.render_version = None
+            target.summary_html = renderer.summarize(u'<p>{0!s}</p>'.format(escape(value or u'')))
+            target._render_pending = True
+            return
+        target.body_html = renderer.render(value)
+        target.summary_html = renderer.summarize(target.body_html)
+        target.render_version = RENDER_VERSION
+
+    @staticmethod
+    def url_title_for(title):
+        return pinyin.get(title).replace(' ', '-').lower()
 
     @staticmethod
     def on_change_title(target, value, oldvalue, initiator):
-        target.url_title = pinyin.get(value).replace(' ', '-').lower()
+        target.url_title = Post.url_title_for(value)
 
     @staticmethod
     def generate_fake(count=100):
@@ -127,7 +173,7 @@ class Post(db.Model):
 
     def to_json(self):
         json_post = {'url': url_for('api.get_post', id=self.id, _external=True), 'title': self.title, 'body': self.body,
-                     'body_html': self.body_html, 'tags': [name for name in self.tags], 'timestamp': self.timestamp,
+                     'body_html': self.body_html, 'tags': [tag.name for tag in self.tags], 'timestamp': self.timestamp,
                      'author': url_for('api.get_user', id=self.author_id, _external=True)}
         return json_post
 
@@ -139,15 +185,57 @@ class Post(db.Model):
         body = json_post.get('body')
         if body is None or body == '':
             raise ValidationError('post does not have a body')
-        tags = json_post.get('tags')
-        return Post(title=title, body=body, tags=tags)
+        return Post(title=title, body=body)
 
     def __repr__(self):
         return '<Post {0!r}>'.format(self.title)
 
 
-db.event.listen(Post.body, 'set', Post.on_change_body)
+# body is deferred: load the old value on assignment, or an unchanged body would always look new
+db.event.listen(Post.body, 'set', Post.on_change_body, active_history=True)
 db.event.listen(Post.title, 'set', Post.on_change_title)
+db.event.listen(Post.body, 'set', on_change_post)
+db.event.listen(Post.title, 'set', on_change_post)
+db.event.listen(SignallingSession, 'after_flush', enqueue_deferred_renders)
+
+
+class SiteVersion(db.Model):
+    """A single row counting the commits that changed what pages show.
+
+    It is bumped by every commit that invalidates page cache groups, so
+    listings are validated by reading one row instead of aggregating the
+    post and tag tables.
+    """
+    __tablename__ = 'site_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0)
+    modified = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def current():
+        row = db.session.query(SiteVersion.version, SiteVersion.modified).filter(SiteVersion.id == 1).first()
+        if row is None:
+            return 0, None
+        return row.version, row.modified
+
+    @staticmethod
+    def bump(db_session):
+        table = SiteVersion.__table__
+        now = datetime.utcnow()
+        result = db_session.execute(table.update().where(table.c.id == 1)
+                                    .values(version=table.c.version + 1, modified=now))
+        if result.rowcount == 0:
+            db_session.execute(table.insert().values(id=1, version=1, modified=now))
+
+    @staticmethod
+    def on_before_commit(db_session):
+        # flushed first: the after_flush hooks add the groups of the pending changes
+        db_session.flush()
+        if db_session.info.get('page_cache_groups'):
+            SiteVersion.bump(db_session)
+
+
+db.event.listen(SignallingSession, 'before_commit', SiteVersion.on_before_commit)
 
 
 class User(UserMixin, db.Model):
@@ -160,6 +248,7 @@ class User(UserMixin, db.Model):
     location = db.Column(db.String(64))
     about_me = db.Column(db.Text)
     about_me_html = db.Column(db.Text)
+    about_me_render_version = db.Column(db.String(16))
     member_since = db.Column(db.DateTime, default=datetime.utcnow)
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
@@ -173,10 +262,11 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def on_change_about_me(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.about_me_html = bleach.linkify(
-            bleach.clean(markdown(value, output_format='html'), tags=allowed_tags, strip=True))
+        if value == oldvalue and target.about_me_html is not None and \
+                target.about_me_render_version == RENDER_VERSION:
+            return
+        target.about_me_html = renderer.render(value)
+        target.about_me_render_version = RENDER_VERSION
 
     @property
     def password(self):
@@ -184,14 +274,44 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
+        if self.id is not None:
+            self.uncache()
         self.password_hash = generate_password_hash(password)
 
     def verify_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def is_administrator(self):
+        return self.email is not None and self.email == current_app.config['ZBLOG_ADMIN']
+
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        presence.ping(self)
+
+    @staticmethod
+    def get_cached(id=None, username=None, first=False):
+        if first:
+            key = 'user:first'
+        elif id is not None:
+            key = 'user:id:{0:d}'.format(int(id))
+        else:
+            key = u'user:username:{0!s}'.format(username)
+        user = user_cache.get(key, db.session)
+        if user is not None:
+            # last_seen moves on behind the cache; it is read again, with the buffered pings, when used
+            db.session.expire(user, ['last_seen'])
+            return user
+        if first:
+            user = User.query.first()
+        elif id is not None:
+            user = User.query.get(int(id))
+        else:
+            user = User.query.filter_by(username=username).first()
+        if user is not None:
+            user_cache.set(key, user)
+        return user
+
+    def uncache(self):
+        user_cache.delete('user:first', 'user:id:{0:d}'.format(self.id), u'user:username:{0!s}'.format(self.username))
 
     def gravatar(self, size=100, default='identicon', rating='g'):
         if request.is_secure:
@@ -202,18 +322,33 @@ class User(UserMixin, db.Model):
         return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(url=url, hash=avatar_hash, size=size,
                                                                      default=default, rating=rating)
 
+    def password_fingerprint(self):
+        # tokens carry it, so changing the password revokes them
+        return hashlib.sha1((self.password_hash or '').encode('utf-8')).hexdigest()[:16]
+
     def generate_auth_token(self, expiration):
         s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-        return s.dumps({'id': self.id}).decode('ascii')
+        return s.dumps({'id': self.id, 'pw': self.password_fingerprint()}).decode('ascii')
+
+    @staticmethod
+    def load_cached(id):
+        return User.get_cached(id=id)
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        user = verified_tokens.get(token, User.load_cached)
+        if user is not None:
+            return user
+        s = _token_serializer(current_app.config['SECRET_KEY'])
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except:
             return None
-        return User.query.get(data['id'])
+        user = User.get_cached(id=data['id'])
+        if user is None or data.get('pw') != user.password_fingerprint():
+            return None
+        verified_tokens.set(token, user, header['exp'])
+        return user
 
     @staticmethod
     def generate_fake():
@@ -221,11 +356,11 @@ class User(UserMixin, db.Model):
         db.session.add(u)
         db.session.commit()
 
-    def to_json(self):
+    def to_json(self, post_count=None):
         json_user = {'url': url_for('api.get_post', id=self.id, _external=True), 'username': self.username,
                      'member_since': self.member_since, 'last_seen': self.last_seen,
                      'posts': url_for('api.get_user_posts', id=self.id, _external=True),
-                     'post_count': self.posts.count()}
+                     'post_count': self.posts.count() if post_count is None else post_count}
         return json_user
 
     def __repr__(self):
@@ -233,10 +368,44 @@ class User(UserMixin, db.Model):
 
 
 db.event.listen(User.about_me, 'set', User.on_change_about_me)
+db.event.listen(User, 'load', on_load_user)
+db.event.listen(User, 'refresh', on_load_user)
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64))
+    payload = db.Column(db.Text)
+    # queued, running, done or failed
+    status = db.Column(db.String(16), index=True, default='queued')
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    run_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    lease_until = db.Column(db.DateTime)
+    leased_by = db.Column(db.String(64))
+    last_error = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    finished = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Job {0:d} {1!r}>'.format(self.id or 0, self.name)
+
+
+verified_tokens = VerifiedUserCache()
+_token_serializers = {}
+
+
+def _token_serializer(secret_key):
+    # verifying needs no expiration, so one serializer per key can be reused
+    if secret_key not in _token_serializers:
+        _token_serializers[secret_key] = Serializer(secret_key)
+    return _token_serializers[secret_key]
 
 
 class AnonymousUser(AnonymousUserMixin):
-    pass
+    def is_administrator(self):
+        return False
 
 
 login_manager.anonymous_user = AnonymousUser
@@ -244,4 +413,4 @@ login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return User.get_cached(id=user_id)
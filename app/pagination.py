@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import base64
+import binascii
+from datetime import datetime
+
+from flask import request, abort, url_for
+from sqlalchemy import or_, and_
+
+from app.models import Post
+
+__author__ = 'zhangmm'
+
+_CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(post):
+    raw = '{0!s}|{1:d}'.format(post.timestamp.strftime(_CURSOR_FORMAT), post.id)
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        return datetime.strptime(timestamp, _CURSOR_FORMAT), int(id)
+    except (binascii.Error, TypeError, UnicodeError, ValueError):
+        abort(404)
+
+
+class KeysetPagination(object):
+    keyset = True
+
+    def __init__(self, items, has_prev, has_next):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = encode_cursor(items[0]) if has_prev and items else None
+        self.next_cursor = encode_cursor(items[-1]) if has_next and items else None
+
+
+class Paginator(object):
+    """Pagination of posts, newest first.
+
+    Requests with a ``page`` argument use the classic OFFSET pagination with
+    a total count. Otherwise the posts are paginated by ``(timestamp, id)``
+    keys taken from the opaque ``after`` and ``before`` cursors, which walks
+    the timestamp index and never counts the rows.
+    """
+
+    def __init__(self, per_page, page=None, after=None, before=None):
+        self.per_page = per_page
+        self.page = page
+        self.after = decode_cursor(after) if after else None
+        self.before = decode_cursor(before) if before and not after else None
+
+    @staticmethod
+    def from_request(per_page, cursors=True):
+        """The paginator asked for by the request arguments.
+
+        Without ``cursors`` (the API) a request is paginated by page number,
+        the first page by default, unless it has an ``after`` or ``before``
+        argument; ``after=`` with no value starts from the newest post.
+        """
+        page = request.args.get('page', type=int)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        if page is None and not cursors and after is None and before is None:
+            page = 1
+        return Paginator(per_page, page=page, after=after, before=before)
+
+    @property
+    def keyset(self):
+        return self.page is None
+
+    def window(self, query):
+        if not self.keyset:
+            return query.order_by(Post.timestamp.desc(), Post.id.desc()) \
+                .limit(self.per_page).offset((max(self.page, 1) - 1) * self.per_page)
+        if self.before:
+            timestamp, id = self.before
+            query = query.filter(or_(Post.timestamp > timestamp,
+                                     and_(Post.timestamp == timestamp, Post.id > id)))
+            return query.order_by(Post.timestamp.asc(), Post.id.asc()).limit(self.per_page + 1)
+        if self.after:
+            timestamp, id = self.after
+            query = query.filter(or_(Post.timestamp < timestamp,
+                                     and_(Post.timestamp == timestamp, Post.id < id)))
+        return query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(self.per_page + 1)
+
+    def paginate(self, query):
+        if not self.keyset:
+            return query.order_by(Post.timestamp.desc(), Post.id.desc()).paginate(
+                self.page, per_page=self.per_page, error_out=False)
+        items = self.window(query).all()
+        more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if self.before:
+            items.reverse()
+            return KeysetPagination(items, has_prev=more, has_next=True)
+        return KeysetPagination(items, has_prev=self.after is not None, has_next=more)
+
+    def links(self, pagination, endpoint, **values):
+        prev = next = None
+        if self.keyset:
+            if pagination.has_prev:
+                prev = url_for(endpoint, before=pagination.prev_cursor, **values)
+            if pagination.has_next:
+                next = url_for(endpoint, after=pagination.next_cursor, **values)
+        else:
+            if pagination.has_prev:
+                prev = url_for(endpoint, page=pagination.page - 1, **values)
+            if pagination.has_next:
+                next = url_for(endpoint, page=pagination.page + 1, **values)
+        return prev, next
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.orm.attributes import set_committed_value
+
+__author__ = 'zhangmm'
+
+
+class _PresenceState(object):
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+
+class Presence(object):
+    """Coalesces ``User.last_seen`` writes.
+
+    Pings only update the user object and an in-memory buffer; a background
+    thread writes the buffered times with one UPDATE every
+    ``ZBLOG_LAST_SEEN_INTERVAL`` seconds, so each user costs at most one write
+    per interval. Users loaded in the meantime see their buffered time. An
+    interval of 0 writes through the session on every ping.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_LAST_SEEN_INTERVAL', 60)
+        state = _PresenceState(app, app.config['ZBLOG_LAST_SEEN_INTERVAL'])
+        app.extensions['presence'] = state
+        if state.interval:
+            _states.add(state)
+
+    def ping(self, user):
+        state = current_app.extensions['presence']
+        now = datetime.utcnow()
+        if not state.interval or user.id is None:
+            user.last_seen = now
+            current_app.extensions['sqlalchemy'].db.session.add(user)
+            return
+        set_committed_value(user, 'last_seen', now)
+        with state.lock:
+            state.pending[user.id] = now
+            if state.thread is None:
+                state.thread = threading.Thread(target=self._run, args=(state,))
+                state.thread.daemon = True
+                state.thread.start()
+
+    def _run(self, state):
+        while True:
+            time.sleep(state.interval)
+            _flush(state)
+
+    def flush(self, state=None):
+        return _flush(state or current_app.extensions['presence'])
+
+
+def _flush(state):
+    with state.lock:
+        pending, state.pending = state.pending, {}
+    if not pending:
+        return 0
+    from app.models import User
+
+    table = User.__table__
+    statement = table.update().where(table.c.id == bindparam('user_id')).values(last_seen=bindparam('seen'))
+    try:
+        # a connection of its own, the scoped session of the caller is left alone
+        db = state.app.extensions['sqlalchemy'].db
+        with db.get_engine(state.app).begin() as connection:
+            connection.execute(statement, [{'user_id': id, 'seen': seen} for id, seen in pending.items()])
+    except Exception:
+        state.app.logger.exception('Failed to write last seen times')
+        with state.lock:
+            for id, seen in pending.items():
+                state.pending.setdefault(id, seen)
+        return 0
+    return len(pending)
+
+
+# the buffers of every app still alive are written when the process exits
+_states = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for state in list(_states):
+        _flush(state)
+
+
+def on_load_user(target, context, attrs=None):
+    state = current_app.extensions.get('presence')
+    if state is None or (attrs is not None and 'last_seen' not in attrs):
+        return
+    seen = state.pending.get(target.id)
+    if seen is not None and (target.last_seen is None or seen > target.last_seen):
+        set_committed_value(target, 'last_seen', seen)
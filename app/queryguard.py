@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import re
+import sys
+
+from flask import current_app, request, g, has_app_context
+from flask.ext.sqlalchemy import get_debug_queries
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__author__ = 'zhangmm'
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_RE = re.compile(r'\bIN \((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_PARAM_RE = re.compile(r'%\(\w+\)s|%s|:\w+')
+
+# every repeated statement reported by any app of the process, for manage.py test
+reports = []
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+def normalize(statement):
+    """Reduce a statement to its shape: literals, parameters and IN lists become ``?``."""
+    statement = _STRING_RE.sub('?', statement)
+    statement = _PARAM_RE.sub('?', statement)
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _IN_RE.sub('IN (?)', statement)
+    return ' '.join(statement.split())
+
+
+def _template_location():
+    frame = sys._getframe(1)
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return '{0!s}:{1:d}'.format(template.name or template.filename,
+                                        template.get_corresponding_lineno(frame.f_lineno))
+        frame = frame.f_back
+    return None
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_template(conn, cursor, statement, parameters, context, executemany):
+    # kept in step with the queries Flask-SQLAlchemy records in the same event, during requests only
+    if has_app_context():
+        locations = g.get('_query_guard_templates')
+        if locations is not None:
+            locations.append(_template_location())
+
+
+class QueryGuard(object):
+    """Detects N+1 queries: the same statement shape issued again and again by one request.
+
+    With ``ZBLOG_QUERY_GUARD`` set to ``'warn'`` or ``'raise'``, the queries
+    recorded by Flask-SQLAlchemy (``SQLALCHEMY_RECORD_QUERIES``) are grouped
+    by normalize() after every request, and shapes seen at least
+    ``ZBLOG_QUERY_REPEAT_THRESHOLD`` times are logged together with the view
+    and the template line that issued the first of them. ``'raise'`` fails
+    the request with RepeatedQueryError instead.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_QUERY_GUARD', None)
+        app.config.setdefault('ZBLOG_QUERY_REPEAT_THRESHOLD', 5)
+        mode = app.config['ZBLOG_QUERY_GUARD']
+        app.extensions['query_guard'] = mode if mode in ('warn', 'raise') else None
+        if app.extensions['query_guard']:
+            app.before_request(self._before_request)
+            app.after_request(self._after_request)
+
+    def _before_request(self):
+        g._query_guard_offset = len(get_debug_queries())
+        g._query_guard_templates = []
+
+    def _after_request(self, response):
+        queries = get_debug_queries()[g.get('_query_guard_offset', 0):]
+        templates = g.get('_query_guard_templates') or []
+        g._query_guard_templates = None
+        shapes = {}
+        for i, query in enumerate(queries):
+            shape = normalize(query.statement)
+            if shape not in shapes:
+                shapes[shape] = [0, query.context, templates[i] if i < len(templates) else None]
+            shapes[shape][0] += 1
+        threshold = current_app.config['ZBLOG_QUERY_REPEAT_THRESHOLD']
+        found = []
+        for shape, (count, context, template) in shapes.items():
+            if count >= threshold:
+                found.append('{0!s} issued {1:d} times the query {2!s}\n  from {3!s}{4!s}'.format(
+                    request.endpoint, count, shape, context,
+                    ', template {0!s}'.format(template) if template else ''))
+        if found:
+            reports.extend(found)
+            for report in found:
+                current_app.logger.warning('Repeated query: {0!s}'.format(report))
+            if current_app.extensions['query_guard'] == 'raise':
+                raise RepeatedQueryError('\n'.join(found))
+        return response
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import os
+import re
+import math
+import heapq
+import pickle
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from flask import current_app
+from flask.ext.sqlalchemy import SignallingSession, Pagination
+from sqlalchemy import event, text
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__author__ = 'zhangmm'
+
+_CJK = u'㐀-䶿一-鿿豈-﫿'
+_TOKEN_RE = re.compile(u'[{0}]+|[^\\W_{0}]+'.format(_CJK), re.UNICODE)
+_CJK_RE = re.compile(u'[{0}]'.format(_CJK), re.UNICODE)
+
+# a match in the title counts as much as this many matches in the body
+TITLE_WEIGHT = 5.0
+
+
+def tokenize(value, unigrams=False):
+    """Split text into lowercase words, and runs of Chinese characters into overlapping bigrams.
+
+    With ``unigrams`` the single characters of those runs follow, which is
+    how documents are indexed so that one character queries match too.
+    """
+    tokens = []
+    for word in _TOKEN_RE.findall((value or u'').lower()):
+        if _CJK_RE.match(word) and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            if unigrams:
+                tokens.extend(word)
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def _title_text(title, url_title):
+    # url_title holds the pinyin of the title, so 'zhongwen' finds '中文'
+    return u'{0!s} {1!s}'.format(title or u'', (url_title or u'').replace(u'-', u' '))
+
+
+class PythonIndex(object):
+    """Inverted index kept in memory and saved to ``path``.
+
+    Changes are appended to a journal next to the pickled index and
+    replayed by the other processes; the index itself is pickled again only
+    once ``compact_after`` changes have been journaled. Processes take a lock
+    on a third file around reading and writing them, where fcntl is there.
+    """
+
+    transactional = False
+
+    def __init__(self, path=None, compact_after=1000):
+        self.path = path
+        self.journal = path + '.journal' if path else None
+        self.lock_path = path + '.lock' if path else None
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._offset = 0
+        self._journaled = 0
+        self.postings = {}
+        self.documents = {}
+        self.total_length = 0
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        # the thread lock first, flock is held by the open file and not by a thread
+        with self._lock:
+            if self.path is None or fcntl is None:
+                yield
+                return
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.lock_path, 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        if self.path is None:
+            return
+        if os.path.exists(self.path):
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                with open(self.path, 'rb') as f:
+                    self.postings, self.documents = pickle.load(f)
+                self.total_length = sum(length for length, _ in self.documents.values())
+                self._mtime = mtime
+                self._offset = 0
+                self._journaled = 0
+        if not os.path.exists(self.journal):
+            return
+        if os.path.getsize(self.journal) < self._offset:
+            # compacted by another process, which saved the index first
+            self._offset = 0
+        with open(self.journal, 'rb') as f:
+            f.seek(self._offset)
+            while True:
+                try:
+                    changes = pickle.load(f)
+                except (EOFError, ValueError, pickle.UnpicklingError):
+                    # the end of the journal, or an entry still being written
+                    break
+                # replaying a change twice leaves the same document
+                self._apply(changes)
+                self._journaled += len(changes)
+                self._offset = f.tell()
+
+    def _save(self, changes):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if changes is not None and self._journaled + len(changes) < self.compact_after:
+            with open(self.journal, 'ab') as f:
+                pickle.dump(changes, f, pickle.HIGHEST_PROTOCOL)
+                self._offset = f.tell()
+            self._journaled += len(changes)
+            return
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((self.postings, self.documents), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+        self._mtime = os.path.getmtime(self.path)
+        open(self.journal, 'wb').close()
+        self._offset = 0
+        self._journaled = 0
+
+    def _remove(self, id):
+        document = self.documents.pop(id, None)
+        if document is None:
+            return
+        self.total_length -= document[0]
+        for term in document[1]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def _apply(self, changes):
+        for op, id, title, body in changes:
+            self._remove(id)
+            if op != 'index':
+                continue
+            frequencies = {}
+            for term in tokenize(title, unigrams=True):
+                frequencies[term] = frequencies.get(term, 0) + TITLE_WEIGHT
+            for term in tokenize(body, unigrams=True):
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, {})[id] = frequency
+            length = sum(frequencies.values())
+            self.documents[id] = (length, list(frequencies))
+            self.total_length += length
+
+    def apply(self, changes, connection=None, save=True):
+        # the journal is replayed to its end before appending, and compacted by one process at a time
+        with self._locked():
+            self._load()
+            self._apply(changes)
+            if save:
+                self._save(changes)
+
+    def save(self):
+        with self._locked():
+            self._save(None)
+
+    def count(self):
+        with self._locked(exclusive=False):
+            self._load()
+            return len(self.documents)
+
+    def clear(self):
+        with self._locked():
+            self.postings = {}
+            self.documents = {}
+            self.total_length = 0
+            self._save(None)
+
+    def search(self, terms, offset, limit, k1=1.2, b=0.75):
+        with self._locked(exclusive=False):
+            self._load()
+            postings = [self.postings.get(term) for term in set(terms)]
+            if not postings or None in postings:
+                return 0, []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for other in postings[1:]:
+                candidates.intersection_update(other)
+            count = len(self.documents)
+            average = self.total_length / float(count)
+            weights = [math.log(1 + (count - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+
+            def score(id):
+                norm = k1 * (1 - b + b * self.documents[id][0] / average)
+                return sum(w * p[id] * (k1 + 1) / (p[id] + norm) for w, p in zip(weights, postings))
+
+            ranked = heapq.nlargest(offset + limit, candidates, key=score)
+            return len(candidates), ranked[offset:]
+
+
+class FTS5Index(object):
+    """SQLite FTS5 table written in the same transaction as the posts."""
+
+    transactional = True
+
+    @staticmethod
+    def create(engine):
+        # in a transaction of its own, which a rollback of the session cannot undo
+        with engine.begin() as connection:
+            connection.execute(text('CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, body)'))
+
+    def _execute(self, connection, statement, **params):
+        return connection.execute(text(statement), **params)
+
+    def apply(self, changes, connection):
+        for op, id, title, body in changes:
+            self._execute(connection, 'DELETE FROM post_fts WHERE rowid = :id', id=id)
+            if op == 'index':
+                self._execute(connection, 'INSERT INTO post_fts (rowid, title, body) VALUES (:id, :title, :body)',
+                              id=id, title=u' '.join(tokenize(title, unigrams=True)),
+                              body=u' '.join(tokenize(body, unigrams=True)))
+
+    def clear(self, connection):
+        self._execute(connection, 'DELETE FROM post_fts')
+
+    def count(self, connection):
+        return self._execute(connection, 'SELECT count(*) FROM post_fts').scalar()
+
+    def search(self, terms, offset, limit, connection=None):
+        match = u' '.join(u'"{0!s}"'.format(term) for term in set(terms))
+        count = self._execute(connection, 'SELECT count(*) FROM post_fts WHERE post_fts MATCH :match',
+                              match=match).scalar()
+        rows = self._execute(connection, 'SELECT rowid FROM post_fts WHERE post_fts MATCH :match '
+                                         'ORDER BY bm25(post_fts, {0!r}, 1.0) LIMIT :limit OFFSET :offset'
+                             .format(TITLE_WEIGHT), match=match, limit=limit, offset=offset)
+        return count, [row[0] for row in rows]
+
+
+def fts5_available():
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute('CREATE VIRTUAL TABLE test USING fts5(body)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+class Search(object):
+    """Full text search over post titles and bodies.
+
+    Posts are indexed incrementally: setting ``Post.title`` or ``Post.body``
+    marks the post, and the marked posts are written to the index when the
+    session flushes (FTS5, same transaction) or commits (pure Python index).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ZBLOG_SEARCH_BACKEND', 'auto')
+        app.config.setdefault('ZBLOG_SEARCH_INDEX_PATH', None)
+        backend = app.config['ZBLOG_SEARCH_BACKEND']
+        if backend == 'auto':
+            uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+            backend = 'fts5' if uri.startswith('sqlite') and fts5_available() else 'python'
+        if backend == 'fts5':
+            FTS5Index.create(app.extensions['sqlalchemy'].db.get_engine(app))
+            app.extensions['search'] = FTS5Index()
+        else:
+            app.extensions['search'] = PythonIndex(app.config['ZBLOG_SEARCH_INDEX_PATH'])
+
+    @property
+    def index(self):
+        return current_app.extensions['search']
+
+    def _connection(self):
+        return current_app.extensions['sqlalchemy'].db.session.connection()
+
+    def query(self, q, page, per_page, content=False):
+        from app.models import Post
+
+        terms = tokenize(q)
+        if not terms:
+            return Pagination(None, page, per_page, 0, [])
+        offset = (max(page, 1) - 1) * per_page
+        if self.index.transactional:
+            total, ids = self.index.search(terms, offset, per_page, connection=self._connection())
+        else:
+            total, ids = self.index.search(terms, offset, per_page)
+        posts = dict((post.id, post) for post in Post.listing(Post.query.filter(Post.id.in_(ids)), content).all()) \
+            if ids else {}
+        return Pagination(None, page, per_page, total, [posts[id] for id in ids if id in posts])
+
+    def rebuild(self, chunk_size=500):
+        from app.models import Post
+
+        db = current_app.extensions['sqlalchemy'].db
+        query = db.session.query(Post.id, Post.title, Post.url_title, Post.body).order_by(Post.id)
+        if self.index.transactional:
+            self.index.clear(self._connection())
+        else:
+            self.index.clear()
+        count = 0
+        changes = []
+        for id, title, url_title, body in query.yield_per(chunk_size):
+            changes.append(('index', id, _title_text(title, url_title), body))
+            if len(changes) >= chunk_size:
+                self._apply(changes)
+                count += len(changes)
+                changes = []
+        self._apply(changes)
+        if not self.index.transactional:
+            self.index.save()
+        db.session.commit()
+        return count + len(changes)
+
+    def count(self):
+        """Number of posts in the index."""
+        if self.index.transactional:
+            return self.index.count(self._connection())
+        return self.index.count()
+
+    def _apply(self, changes):
+        if self.index.transactional:
+            self.index.apply(changes, self._connection())
+        else:
+            # saved once by rebuild
+            self.index.apply(changes, save=False)
+
+
+def on_change_post(target, value, oldvalue, initiator):
+    if value != oldvalue:
+        target._search_dirty = True
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _index_after_flush(db_session, flush_context):
+    from app.models import Post
+
+    index = db_session.app.extensions.get('search')
+    if index is None:
+        return
+    changes = []
+    for post in db_session.new.union(db_session.dirty):
+        if isinstance(post, Post) and getattr(post, '_search_dirty', False):
+            changes.append(('index', post.id, _title_text(post.title, post.url_title), post.body))
+            post._search_dirty = False
+    for post in db_session.deleted:
+        if isinstance(post, Post):
+            changes.append(('delete', post.id, None, None))
+    if not changes:
+        return
+    if index.transactional:
+        index.apply(changes, db_session.connection())
+    else:
+        db_session.info.setdefault('search_changes', []).extend(changes)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _index_after_commit(db_session):
+    changes = db_session.info.pop('search_changes', None)
+    if changes:
+        db_session.app.extensions['search'].apply(changes)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _discard_after_rollback(db_session):
+    db_session.info.pop('search_changes', None)
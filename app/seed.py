@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import bisect
+import hashlib
+import multiprocessing
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+__author__ = 'zhangmm'
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et '
+         'dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea '
+         'commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur '
+         'excepteur sint occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim id est '
+         'laborum python flask blog cache query index render template server client').split()
+
+
+def parse_range(value):
+    """'2-5' -> (2, 5), '3' -> (3, 3)"""
+    if isinstance(value, tuple):
+        return value
+    low, _, high = str(value).partition('-')
+    return int(low), int(high or low)
+
+
+def _sentence(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _body(rng, length):
+    paragraphs = []
+    while length > 0:
+        words = min(length, rng.randint(20, 80))
+        length -= words
+        sentences = []
+        while words > 0:
+            count = min(words, rng.randint(5, 15))
+            sentences.append(_sentence(rng, count))
+            words -= count
+        paragraph = ' '.join(sentences)
+        if rng.random() < 0.3:
+            word = rng.choice(WORDS)
+            paragraph = paragraph.replace(' ' + word + ' ', ' *' + word + '* ', 1)
+        paragraphs.append(paragraph)
+    if rng.random() < 0.5:
+        paragraphs.insert(rng.randint(0, len(paragraphs)), '## ' + _sentence(rng, 3)[:-1])
+    return '\n\n'.join(paragraphs)
+
+
+class _Authors(object):
+    # picks authors with weight 1 / rank ** skew: 0 is uniform, 1 is Zipf
+    def __init__(self, ids, skew):
+        self.ids = ids
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(ids) + 1):
+            total += 1.0 / rank ** skew
+            self.cumulative.append(total)
+
+    def pick(self, rng):
+        return self.ids[min(bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1]), len(self.ids) - 1)]
+
+
+def _inserted_ids(db, table, column, keys, chunk_size=500):
+    # the database assigned the ids, they are read back by a column unique to this seed
+    from sqlalchemy import select
+
+    ids = {}
+    for i in range(0, len(keys), chunk_size):
+        ids.update(db.session.execute(select([table.c[column], table.c.id])
+                                      .where(table.c[column].in_(keys[i:i + chunk_size]))).fetchall())
+    return [ids[key] for key in keys]
+
+
+def seed(users=100, posts=1000, tags=50, tags_per_post=(0, 5), author_skew=1.0, body_words=(50, 500), seed=0,
+         batch_size=1000, workers=None, days=365, progress=None):
+    """Bulk insert fake users, tags and posts for load testing.
+
+    Rows are generated by a random.Random(``seed``), so the same arguments
+    give the same data, dated relative to the current day; names, titles and
+    emails also carry a token of the seed, and seeding a database again takes
+    another ``seed`` to keep them unique. They are
+    written with executemany INSERTs committed every ``batch_size`` posts,
+    and get their ids from the database. Posts are
+    spread over the last ``days`` days and their authors follow a Zipf-like
+    distribution of exponent ``author_skew``; ``tags_per_post`` and
+    ``body_words`` are (min, max) ranges. The Markdown is rendered in ``workers`` processes, so posts are
+    stored with ``body_html``, ``summary_html`` and ``url_title`` as if they
+    had been written through the site. The search index is rebuilt at the end.
+    ``progress`` is called with a line after every batch.
+    """
+    from itertools import repeat
+    from concurrent.futures import ProcessPoolExecutor
+    from app import db, page_cache, search
+    from app.markup import RENDER_VERSION, renderer, _render_batch
+    from app.models import User, Post, Tag, PostTags
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    tags_per_post = parse_range(tags_per_post)
+    body_words = parse_range(body_words)
+    workers = workers or multiprocessing.cpu_count()
+
+    run = hashlib.md5(str(seed).encode('utf-8')).hexdigest()[:6]
+    user_table = User.__table__
+    password_hash = generate_password_hash('password')
+    user_rows = []
+    for n in range(1, users + 1):
+        username = 'user{0!s}-{1:d}'.format(run, n)
+        email = '{0!s}@example.com'.format(username)
+        user_rows.append({'email': email, 'username': username,
+                          'password_hash': password_hash, 'name': _sentence(rng, 2)[:-1],
+                          'location': rng.choice(WORDS).capitalize(), 'member_since': now - timedelta(days=days),
+                          'last_seen': now, 'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest()})
+    if user_rows:
+        db.session.execute(user_table.insert(), user_rows)
+    author_ids = _inserted_ids(db, user_table, 'username', [row['username'] for row in user_rows]) or \
+        [id for id, in db.session.query(User.id)]
+
+    tag_table = Tag.__table__
+    tag_rows = [{'name': '{0!s}-{1!s}-{2:d}'.format(rng.choice(WORDS), run, n), 'modified': now}
+                for n in range(1, tags + 1)]
+    if tag_rows:
+        db.session.execute(tag_table.insert(), tag_rows)
+    tag_ids = _inserted_ids(db, tag_table, 'name', [row['name'] for row in tag_rows]) or \
+        [id for id, in db.session.query(Tag.id)]
+    db.session.commit()
+
+    authors = _Authors(author_ids, author_skew) if author_ids else None
+    post_table = Post.__table__
+    post_tag_table = PostTags.__table__
+    done = 0
+    with ProcessPoolExecutor(workers) as executor:
+        while done < posts:
+            rows = []
+            for n in range(done + 1, min(done + batch_size, posts) + 1):
+                # within the 64 characters of the column
+                title = '{0!s} {1!s}-{2:d}'.format(_sentence(rng, rng.randint(2, 6))[:-1][:48].rstrip(), run, n)
+                timestamp = now - timedelta(seconds=rng.randint(0, days * 86400))
+                rows.append({'title': title, 'url_title': Post.url_title_for(title),
+                             'body': _body(rng, rng.randint(*body_words)), 'timestamp': timestamp,
+                             'modified': timestamp, 'author_id': authors.pick(rng) if authors else None,
+                             'render_version': RENDER_VERSION})
+            numbered = list(enumerate(row['body'] for row in rows))
+            batches = [numbered[i::workers] for i in range(workers)]
+            rendered = dict((i, (html, summary)) for batch in
+                            executor.map(_render_batch, batches, repeat(renderer.summary_length))
+                            for i, html, summary in batch)
+            for i, row in enumerate(rows):
+                row['body_html'], row['summary_html'] = rendered[i]
+            db.session.execute(post_table.insert(), rows)
+            post_ids = _inserted_ids(db, post_table, 'url_title', [row['url_title'] for row in rows])
+            pairs = []
+            for id in post_ids:
+                count = min(rng.randint(*tags_per_post), len(tag_ids))
+                pairs.extend({'post_id': id, 'tag_id': tag_id} for tag_id in rng.sample(tag_ids, count))
+            if pairs:
+                db.session.execute(post_tag_table.insert(), pairs)
+            db.session.commit()
+            done += len(rows)
+            if progress is not None:
+                progress('{0:d}/{1:d} posts'.format(done, posts))
+
+    page_cache.invalidate('posts', 'tags', 'users', 'feeds')
+    db.session.commit()
+    search.rebuild()
+    return {'users': len(user_rows), 'tags': len(tag_rows), 'posts': done}
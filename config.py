@@ -23,9 +23,63 @@ class Config(object):
     ZBLOG_FOLLOWERS_PER_PAGE = 50
     ZBLOG_COMMENTS_PER_PAGE = 30
     SQLALCHEMY_RECORD_QUERIES = True
+    # connection pool of server databases, None keeps the driver defaults; also pools SQLite files when set
+    SQLALCHEMY_POOL_SIZE = int(os.environ['ZBLOG_DB_POOL_SIZE']) if os.environ.get('ZBLOG_DB_POOL_SIZE') else None
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ['ZBLOG_DB_MAX_OVERFLOW']) if os.environ.get('ZBLOG_DB_MAX_OVERFLOW') \
+        else None
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ['ZBLOG_DB_POOL_RECYCLE']) if os.environ.get('ZBLOG_DB_POOL_RECYCLE') \
+        else None
+    # test pooled server connections before use
+    ZBLOG_DB_PRE_PING = False
+    # PRAGMAs run on every new SQLite connection
+    ZBLOG_SQLITE_PRAGMAS = {}
+    # log the effective engine settings at startup
+    ZBLOG_DB_REPORT = False
     ZBLOG_SLOW_DB_QUERY_TIME = 0.5
+    # X-Query-Count and friends on every response
+    ZBLOG_METRICS_HEADERS = bool(os.environ.get('ZBLOG_METRICS_HEADERS'))
+    # 'warn' or 'raise' when a request repeats a query shape ZBLOG_QUERY_REPEAT_THRESHOLD times
+    ZBLOG_QUERY_GUARD = os.environ.get('ZBLOG_QUERY_GUARD')
+    ZBLOG_QUERY_REPEAT_THRESHOLD = 5
+    # background calls: threads, calls waiting for one, seconds to wait for room before QueueFull
+    ZBLOG_EXECUTOR_WORKERS = 4
+    ZBLOG_EXECUTOR_QUEUE_SIZE = 100
+    ZBLOG_EXECUTOR_SUBMIT_TIMEOUT = 0
     ZBLOG_TITLE = 'zhangmm\' blog'
     ZBLOG_TITLE_SUFFIX = 'ZBlog'
+    # 'simple' (in-process LRU), 'filesystem' or None to disable
+    ZBLOG_PAGE_CACHE = os.environ.get('ZBLOG_PAGE_CACHE', 'simple') or None
+    ZBLOG_PAGE_CACHE_SIZE = 500
+    ZBLOG_PAGE_CACHE_DIR = os.path.join(basedir, 'temp/page-cache')
+    # 'fts5', 'python' or 'auto' to use FTS5 whenever the database is SQLite with FTS5 compiled in
+    ZBLOG_SEARCH_BACKEND = os.environ.get('ZBLOG_SEARCH_BACKEND') or 'auto'
+    ZBLOG_SEARCH_INDEX_PATH = os.path.join(basedir, 'temp/search-index.pickle')
+    ZBLOG_MARKDOWN_CACHE_SIZE = 1024
+    # characters of text kept in post summaries, run 'manage.py rerender --all' after changing it
+    ZBLOG_SUMMARY_LENGTH = 300
+    # seconds between writes of User.last_seen, 0 writes on every request
+    ZBLOG_LAST_SEEN_INTERVAL = 60
+    # seconds a verified API email/password pair is trusted without hashing it again
+    ZBLOG_CREDENTIALS_CACHE_TTL = 60
+    # seconds a process keeps a user row, other processes see a change only after that
+    ZBLOG_USER_CACHE_TTL = 300
+    # posts per transaction of the batch api, keep below ZBLOG_MARKDOWN_CACHE_SIZE
+    ZBLOG_BATCH_CHUNK_SIZE = 200
+    # processes rendering markdown for the batch api, 0 for one per cpu
+    ZBLOG_BATCH_WORKERS = 0
+    ZBLOG_EXPORT_CHUNK_SIZE = 500
+    ZBLOG_FEED_SIZE = 20
+    ZBLOG_SITEMAP_CHUNK_SIZE = 1000
+    # gzip responses (and brotli if the module is installed), prefer the web server's when there is one
+    ZBLOG_COMPRESS = bool(os.environ.get('ZBLOG_COMPRESS'))
+    ZBLOG_COMPRESS_MIN_SIZE = 500
+    ZBLOG_COMPRESS_CACHE_SIZE = 200
+    # render posts in 'manage.py worker' instead of the request that saves them, needs a shared page cache
+    ZBLOG_DEFER_RENDERING = bool(os.environ.get('ZBLOG_DEFER_RENDERING'))
+    # seconds a worker holds a job, base of the retry delay that doubles with every attempt
+    ZBLOG_JOB_LEASE = 300
+    ZBLOG_JOB_BACKOFF = 10
+    ZBLOG_JOB_MAX_ATTEMPTS = 5
 
     @staticmethod
     def init_app(app):
@@ -34,6 +88,7 @@ class Config(object):
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    ZBLOG_METRICS_HEADERS = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
@@ -44,32 +99,70 @@ class TestingConfig(Config):
     SERVER_NAME = 'localhost:5000'
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
+    ZBLOG_SEARCH_BACKEND = 'python'
+    ZBLOG_SEARCH_INDEX_PATH = None
+    ZBLOG_LAST_SEEN_INTERVAL = 0
+    ZBLOG_BATCH_WORKERS = 1
+    ZBLOG_QUERY_GUARD = 'warn'
+
+    @classmethod
+    def init_app(cls, app):
+        Config.init_app(app)
+        # read as the app is created, so that 'manage.py test --strict_queries' can raise it
+        if cls.ZBLOG_QUERY_GUARD:
+            app.config['ZBLOG_QUERY_GUARD'] = os.environ.get('ZBLOG_QUERY_GUARD') or cls.ZBLOG_QUERY_GUARD
+
+
+class BenchmarkConfig(TestingConfig):
+    # the database of each tier is set by app.bench
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    ZBLOG_PAGE_CACHE = None
+    ZBLOG_QUERY_GUARD = None
+    ZBLOG_METRICS_HEADERS = True
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    SQLALCHEMY_POOL_RECYCLE = Config.SQLALCHEMY_POOL_RECYCLE or 3600
+    ZBLOG_DB_PRE_PING = True
+    # WAL lets readers run alongside the writes of every request (last_seen)
+    ZBLOG_SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        # negative sizes are KiB
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000,
+    }
+    ZBLOG_DB_REPORT = True
 
     @classmethod
     def init_app(cls, app):
         Config.init_app(app)
 
-        # send error log to admin'email
+        # send error log to admin'email, from the background executor
         import logging
-        from logging.handlers import SMTPHandler
+        from app.executor import BackgroundSMTPHandler
 
         # log to stderr
         from logging import StreamHandler
         file_handler = StreamHandler()
         file_handler.setLevel(logging.WARNING)
         app.logger.addHandler(file_handler)
+        # and the database settings report, once per process, and a JSON line per request
+        for name in ('zblog.database', 'zblog.requests'):
+            logger = logging.getLogger(name)
+            if not any(isinstance(handler, StreamHandler) for handler in logger.handlers):
+                logger.setLevel(logging.INFO)
+                logger.addHandler(StreamHandler())
 
         secure = None
         if getattr(cls, 'MAIL_USERNAME', None) is not None:
             credentials = (cls.MAIL_USERNAME, cls.MAIL_PASSWORD)
             if getattr(cls, 'MAIL_USER_TLS', None):
                 secure = ()
-            mail_hanlder = SMTPHandler(
+            mail_hanlder = BackgroundSMTPHandler(
                 mailhost=(cls.MAIL_SERVER, cls.MAIL_PORT),
                 fromaddr=cls.ZBLOG_MAIL_SENDER,
                 toaddrs=[cls.ZBLOG_ADMIN],
@@ -96,6 +189,7 @@ class UnixConfig(ProductionConfig):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
     'default': DevelopmentConfig
 }
@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
+from __future__ import print_function
+
 import os
 
 from flask.ext.script import Manager, Shell
 from flask.ext.migrate import Migrate, MigrateCommand
 
-from app import create_app, db
-from app.models import User, Post, Tag, PostTags
+from app import create_app, db, search
+from app.models import User, Post, Tag, PostTags, Job
 
 __author__ = 'zhangmm'
 
@@ -24,7 +26,7 @@ migrate = Migrate(app, db)
 
 
 def make_shell_context():
-    return dict(app=app, db=db, User=User, Post=Post, Tag=Tag, PostTags=PostTags)
+    return dict(app=app, db=db, User=User, Post=Post, Tag=Tag, PostTags=PostTags, Job=Job)
 
 
 manager.add_command('shell', Shell(make_context=make_shell_context))
@@ -32,15 +34,23 @@ manager.add_command('db', MigrateCommand)
 
 
 @manager.command
-def test(coverage=False):
+def test(coverage=False, strict_queries=False):
     """Run the unit tests"""
+    import sys
     if coverage and os.environ.get('ZBLOG_COVERAGE'):
-        import sys
         os.environ['ZBLOG_COVERAGE'] = '1'
         os.execvp(sys.executable, [sys.executable] + sys.argv)
+    if strict_queries:
+        # requests repeating a query fail with RepeatedQueryError
+        os.environ['ZBLOG_QUERY_GUARD'] = 'raise'
     import unittest
+    from app.queryguard import reports
     tests = unittest.TestLoader().discover('tests')
-    unittest.TextTestRunner(verbosity=2).run(tests)
+    result = unittest.TextTestRunner(verbosity=2).run(tests)
+    if reports:
+        print('Repeated queries:')
+        for report in reports:
+            print(report)
     if COV:
         COV.stop()
         COV.save()
@@ -51,6 +61,8 @@ def test(coverage=False):
         COV.html_report(directory=covdir)
         print('HTML version: file://{0!s}/index.html'.format(covdir))
         COV.erase()
+    if not result.wasSuccessful():
+        sys.exit(1)
 
 
 @manager.command
@@ -61,6 +73,98 @@ def profile(length=25, profile_dir=None):
     app.run()
 
 
+@manager.command
+def reindex():
+    """Rebuild the full text search index"""
+    count = search.rebuild()
+    print('Indexed {0:d} posts.'.format(count))
+
+
+@manager.command
+def rerender(chunk_size=200, workers=0, dry_run=False, all=False, start_after=0):
+    """Re-render the html of posts and profiles rendered by an older Markdown pipeline"""
+    from app.markup import rerender_posts
+    done, changed = rerender_posts(chunk_size=int(chunk_size), workers=int(workers), dry_run=dry_run,
+                                   everything=all, start_after=int(start_after), progress=print)
+    print('Rendered {0:d} posts and profiles, {1:d} changed{2!s}.'.format(done, changed,
+                                                                         ' (dry run)' if dry_run else ''))
+
+
+@manager.command
+def freeze(output='temp/static-site', workers=0, force=False):
+    """Render the public pages into a directory for a static web server"""
+    from app.freeze import freeze as freeze_site
+    counts = freeze_site(output, config_name=os.getenv('ZBLOG_CONFIG') or 'default', workers=int(workers),
+                         force=force)
+    print('{written:d} pages written, {unchanged:d} unchanged, {removed:d} removed, '
+          '{skipped:d} skipped.'.format(**counts))
+
+
+@manager.command
+def compress_static(level=9):
+    """Write gzip and brotli copies of the static files"""
+    from app.compress import precompress_static
+    count = precompress_static(app.static_folder, level=int(level))
+    print('Compressed {0:d} files.'.format(count))
+
+
+# the options are declared: derived from the names, tags/tags_per_post and body_words/batch_size share flags
+@manager.option('-u', '--users', dest='users', type=int, default=100)
+@manager.option('-p', '--posts', dest='posts', type=int, default=1000)
+@manager.option('-t', '--tags', dest='tags', type=int, default=50)
+@manager.option('-n', '--tags_per_post', dest='tags_per_post', default='0-5', help='range like 0-5')
+@manager.option('-a', '--author_skew', dest='author_skew', type=float, default=1.0)
+@manager.option('-w', '--body_words', dest='body_words', default='50-500', help='range like 50-500')
+@manager.option('-s', '--seed', dest='seed', type=int, default=0)
+@manager.option('-b', '--batch_size', dest='batch_size', type=int, default=1000)
+@manager.option('-j', '--workers', dest='workers', type=int, default=0)
+@manager.option('-d', '--days', dest='days', type=int, default=365)
+def seed(users, posts, tags, tags_per_post, author_skew, body_words, seed, batch_size, workers, days):
+    """Bulk insert fake users, tags and posts for load testing"""
+    from app.seed import seed as seed_database
+    counts = seed_database(users=users, posts=posts, tags=tags, tags_per_post=tags_per_post,
+                           author_skew=author_skew, body_words=body_words, seed=seed,
+                           batch_size=batch_size, workers=workers, days=days, progress=print)
+    print('Inserted {users:d} users, {tags:d} tags and {posts:d} posts.'.format(**counts))
+
+
+# declared for the same reason, tiers/threshold and requests/reseed share flags
+@manager.option('-t', '--tiers', dest='tiers', default='1000,10000,100000', help='post counts, comma separated')
+@manager.option('-n', '--requests', dest='requests', type=int, default=50)
+@manager.option('-o', '--output', dest='output', default='temp/bench/results.json')
+@manager.option('-b', '--baseline', dest='baseline', default=None)
+@manager.option('-x', '--threshold', dest='threshold', type=float, default=0.2)
+@manager.option('-r', '--reseed', dest='reseed', action='store_true', default=False)
+@manager.option('-s', '--seed', dest='seed', type=int, default=0)
+def bench(tiers, requests, output, baseline, threshold, reseed, seed):
+    """Benchmark the main routes at several database sizes, optionally against a baseline"""
+    import sys
+    from app import bench as benchmark
+    results = benchmark.run(tiers=[int(posts) for posts in tiers.split(',')], requests=requests,
+                            reseed=reseed, seed=seed, progress=print)
+    benchmark.save(results, output)
+    print('Results written to {0!s}.'.format(output))
+    if baseline is None:
+        return
+    if not os.path.exists(baseline):
+        benchmark.save(results, baseline)
+        print('Baseline written to {0!s}.'.format(baseline))
+        return
+    regressions = benchmark.compare(results, benchmark.load(baseline), threshold)
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        sys.exit(1)
+    print('No regressions against {0!s}.'.format(baseline))
+
+
+@manager.command
+def worker(concurrency=1, poll=1.0, once=False):
+    """Run queued jobs, with once until none is left"""
+    from app.jobs import Worker
+    Worker(app, concurrency=int(concurrency), poll_interval=float(poll)).run(once=once)
+
+
 @manager.command
 def deploy():
     """Run deployment tasks"""
@@ -69,6 +173,14 @@ def deploy():
     # upgrade database
     upgrade()
 
+    # index the posts written before search existed, or while the index was lost
+    if search.count() < Post.query.count():
+        reindex()
+
+    # compress static files, they are only served when compression is on
+    if app.config['ZBLOG_COMPRESS']:
+        compress_static()
+
 
 if __name__ == '__main__':
     manager.run()
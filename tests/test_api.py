@@ -4,11 +4,13 @@
 import unittest
 import json
 from base64 import b64encode
+from datetime import datetime
 
 from flask import url_for
+from six.moves.urllib.parse import urlsplit
 
 from app import create_app, db
-from app.models import User, Post
+from app.models import User, Post, Tag, PostTags
 
 __author__ = 'zhangmm'
 
@@ -34,6 +36,12 @@ class APITestCase(unittest.TestCase):
             'Content-Type': 'application/json'
         }
 
+    @staticmethod
+    def local_url(url):
+        # the test client of Flask 0.10 drops the query string of absolute URLs
+        parts = urlsplit(url)
+        return parts.path + ('?' + parts.query if parts.query else '')
+
     def test_404(self):
         response = self.client.get('wrong/url', headers=self.get_api_headers('email', 'password'))
         self.assertTrue(response.status_code == 404)
@@ -92,7 +100,7 @@ class APITestCase(unittest.TestCase):
 
         # write a post
         response = self.client.post(url_for('api.new_post'), headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'),
-                                    data=json.dumps({'body': 'body of the *zblog* post'}))
+                                    data=json.dumps({'title': 'zblog', 'body': 'body of the *zblog* post'}))
         self.assertTrue(response.status_code == 201)
         url = response.headers.get('Location')
         self.assertIsNotNone(url)
@@ -115,6 +123,17 @@ class APITestCase(unittest.TestCase):
         self.assertTrue(json_response.get('count', 0) == 1)
         self.assertTrue(json_response['posts'][0] == json_post)
 
+        # cursor pages are counted on request
+        response = self.client.get(self.local_url(url_for('api.get_user_posts', id=u.id, after='')),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue('count' not in json_response)
+        self.assertTrue(json_response['posts'][0] == json_post)
+        response = self.client.get(self.local_url(url_for('api.get_user_posts', id=u.id, after='', count=1)),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(json_response.get('count', 0) == 1)
+
         # edit post
         response = self.client.put(url, headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'),
                                    data=json.dumps({'body': 'updated body'}))
@@ -124,6 +143,80 @@ class APITestCase(unittest.TestCase):
         self.assertTrue(json_response['body'] == 'updated body')
         self.assertTrue(json_response['body_html'] == '<p>updated body</p>')
 
+    def test_batch_posts(self):
+        u = User(email='zhangmin6105@qq.com', password='cat')
+        t = Tag(name='python')
+        db.session.add_all([u, t])
+        db.session.commit()
+
+        # a JSON array, with one invalid item
+        response = self.client.post(url_for('api.new_posts'),
+                                    headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'),
+                                    data=json.dumps([{'title': 'first', 'body': 'body of *first*', 'tags': ['python']},
+                                                     {'title': 'second'},
+                                                     {'title': 'third', 'body': 'body of third', 'tags': ['go']}]))
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(json_response['created'] == 1)
+        self.assertTrue([result['status'] for result in json_response['results']] == [201, 400, 400])
+        post = Post.query.filter_by(title='first').first()
+        self.assertTrue(post.body_html == '<p>body of <em>first</em></p>')
+        self.assertTrue([tag.name for tag in post.tags] == ['python'])
+
+        # one post per line
+        headers = self.get_api_headers('zhangmin6105@qq.com', 'cat')
+        headers['Content-Type'] = 'application/x-ndjson'
+        response = self.client.post(url_for('api.new_posts'), headers=headers,
+                                    data='{"title": "fourth", "body": "four"}\nnot json\n')
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue([result['status'] for result in json_response['results']] == [201, 400])
+        self.assertTrue(Post.query.count() == 2)
+
+        # anything but an array is rejected
+        response = self.client.post(url_for('api.new_posts'),
+                                    headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'),
+                                    data=json.dumps({'title': 'first'}))
+        self.assertTrue(response.status_code == 400)
+
+    def test_export_posts(self):
+        u1 = User(email='zhangmin6105@qq.com', password='cat')
+        u2 = User(email='zhangmin@qq.com', password='dog')
+        t = Tag(name='python')
+        db.session.add_all([u1, u2, t])
+        db.session.commit()
+        posts = [Post(title='post {0:d}'.format(i), body='body {0:d}'.format(i), author=u1 if i % 2 else u2)
+                 for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        db.session.add(PostTags(post_id=posts[0].id, tag_id=t.id))
+        db.session.commit()
+        self.app.config['ZBLOG_EXPORT_CHUNK_SIZE'] = 2
+
+        # every post, one per line, in id order
+        response = self.client.get(url_for('api.export_posts'),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        self.assertTrue([line['title'] for line in lines] == ['post {0:d}'.format(i) for i in range(5)])
+
+        # filtered by author and tag
+        response = self.client.get(self.local_url(url_for('api.export_posts', author=u1.id)),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        self.assertTrue(len(response.data.decode('utf-8').splitlines()) == 2)
+        response = self.client.get(self.local_url(url_for('api.export_posts', tag='python')),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        self.assertTrue([line['tags'] for line in lines] == [['python']])
+
+        # filtered by modification time
+        response = self.client.get(self.local_url(url_for('api.export_posts', since='2999-01-01')),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        self.assertTrue(response.data == b'')
+        response = self.client.get(self.local_url(url_for('api.export_posts', since='yesterday')),
+                                   headers=self.get_api_headers('zhangmin6105@qq.com', 'cat'))
+        self.assertTrue(response.status_code == 400)
+
     def test_user(self):
         # add two users
         u1 = User(email='zhangmin6105@qq.com', username='zhangmm', password='cat')
@@ -137,8 +230,47 @@ class APITestCase(unittest.TestCase):
         self.assertTrue(response.status_code == 200)
         json_response = json.loads(response.data.decode('utf-8'))
         self.assertTrue(json_response['username'] == 'zhangmm')
+        headers = self.get_api_headers('zhangmin6105@qq.com', 'cat')
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get(url_for('api.get_user', id=u1.id), headers=headers)
+        self.assertTrue(response.status_code == 304)
         response = self.client.get(url_for('api.get_user', id=u2.id),
                                    headers=self.get_api_headers('zhangmin@qq.com', 'cat'))
         self.assertTrue(response.status_code == 200)
         json_response = json.loads(response.data.decode('utf-8'))
         self.assertTrue(json_response['username'] == 'zhangmin')
+
+    def test_cursor_pagination(self):
+        self.app.config['ZBLOG_POSTS_PER_PAGE'] = 2
+        u = User(email='zhangmin6105@qq.com', username='zhangmm', password='cat')
+        posts = [Post(title='post {0}'.format(i), body='body', author=u, timestamp=datetime(2015, 11, i + 1))
+                 for i in range(3)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+
+        # page numbers by default
+        response = self.client.get(url_for('api.get_posts'), headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(json_response['count'] == 3)
+        self.assertIsNone(json_response['next_cursor'])
+        self.assertTrue('page=2' in json_response['next'])
+
+        # the first cursor page has the two newest posts and no previous page
+        response = self.client.get(self.local_url(url_for('api.get_posts', after='')),
+                                   headers=self.get_api_headers('', ''))
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue([p['title'] for p in json_response['posts']] == ['post 2', 'post 1'])
+        self.assertIsNone(json_response['prev'])
+        self.assertIsNotNone(json_response['next_cursor'])
+
+        # follow the cursor to the oldest post
+        response = self.client.get(self.local_url(json_response['next']), headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue([p['title'] for p in json_response['posts']] == ['post 0'])
+        self.assertIsNone(json_response['next'])
+
+        # and back again
+        response = self.client.get(self.local_url(json_response['prev']), headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue([p['title'] for p in json_response['posts']] == ['post 2', 'post 1'])
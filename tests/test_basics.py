@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
+import os
 import unittest
 
 from flask import current_app
@@ -29,3 +30,16 @@ class BasicTestCase(unittest.TestCase):
     def test_app_is_testing(self):
         """Test the app is testing"""
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_query_guard_from_environment(self):
+        """Test the query guard mode is read when the app is created"""
+        mode = os.environ.get('ZBLOG_QUERY_GUARD')
+        os.environ['ZBLOG_QUERY_GUARD'] = 'raise'
+        try:
+            self.assertTrue(create_app('testing').config['ZBLOG_QUERY_GUARD'] == 'raise')
+            self.assertIsNone(create_app('benchmark').config['ZBLOG_QUERY_GUARD'])
+        finally:
+            if mode is None:
+                del os.environ['ZBLOG_QUERY_GUARD']
+            else:
+                os.environ['ZBLOG_QUERY_GUARD'] = mode
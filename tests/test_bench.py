@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import unittest
+
+from app.bench import percentile, compare
+
+__author__ = 'zhangmm'
+
+
+class BenchTestCase(unittest.TestCase):
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertTrue(percentile(values, 50) == 50.0)
+        self.assertTrue(percentile(values, 95) == 95.0)
+        self.assertTrue(percentile(values, 99) == 99.0)
+        self.assertTrue(percentile([0.5], 99) == 0.5)
+        self.assertIsNone(percentile([], 50))
+
+    def test_compare(self):
+        baseline = {'tiers': {'1000': {'index': {'p95': 0.1, 'queries': 4.0}}}}
+        same = {'tiers': {'1000': {'index': {'p95': 0.11, 'queries': 4.0}}}}
+        slower = {'tiers': {'1000': {'index': {'p95': 0.2, 'queries': 4.0}}}}
+        more_queries = {'tiers': {'1000': {'index': {'p95': 0.1, 'queries': 24.0}}}}
+        self.assertTrue(compare(same, baseline) == [])
+        self.assertTrue(len(compare(slower, baseline)) == 1)
+        self.assertTrue('queries' in compare(more_queries, baseline)[0])
+        self.assertTrue(compare({'tiers': {}}, baseline) == [])
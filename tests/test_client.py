@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 # encoding:utf-8
 
+import gzip
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
 from flask import url_for
+from flask.ext.sqlalchemy import get_debug_queries
 
-from app import create_app, db
+from app import create_app, db, page_cache, compress
+from app.cache import SimpleCache
+from app.freeze import freeze
+from app.models import User, Post, Tag, PostTags, SiteVersion
+from app.queryguard import normalize, RepeatedQueryError
 
 __author__ = 'zhangmm'
 
@@ -26,3 +36,243 @@ class FlaskClientTestCase(unittest.TestCase):
     def test_home_page(self):
         response = self.client.get(url_for('main.index'))
         self.assertTrue(response.status_code == 200)
+
+    def test_page_cache(self):
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'MISS')
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'HIT')
+        self.assertTrue(page_cache.stats()['hits'] == 1)
+
+        # invalidation only takes effect once the session commits
+        page_cache.invalidate('posts')
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'HIT')
+        db.session.commit()
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'MISS')
+
+    def test_page_cache_generations(self):
+        cache = SimpleCache(max_size=2)
+        cache.bump('a')
+        a = cache.generation('a')
+        cache.bump('b')
+        cache.bump('c')
+        # 'a' is forgotten, without going back to a generation its old pages were stored under
+        self.assertTrue(len(cache._generations) == 2)
+        self.assertTrue(cache.generation('a') not in (a, '0'))
+
+    def test_conditional_get(self):
+        response = self.client.get(url_for('main.posts'))
+        self.assertTrue(response.status_code == 200)
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        response = self.client.get(url_for('main.posts'), headers={'If-None-Match': etag})
+        self.assertTrue(response.status_code == 304)
+        response = self.client.get(url_for('main.posts'), headers={'If-None-Match': '"stale"'})
+        self.assertTrue(response.status_code == 200)
+
+    def test_site_version(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        post = Post(title='hello', body='body of *hello*', author=u)
+        db.session.add_all([u, post])
+        db.session.commit()
+        version, modified = SiteVersion.current()
+        response = self.client.get(url_for('main.posts'))
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+
+        # deleting a post and editing a profile both move the version and its timestamp
+        db.session.delete(post)
+        db.session.commit()
+        self.assertTrue(SiteVersion.current()[0] == version + 1)
+        self.assertTrue(SiteVersion.current()[1] >= modified)
+        response = self.client.get(url_for('main.posts'), headers={'If-None-Match': etag})
+        self.assertTrue(response.status_code == 200)
+        u.about_me = 'about john'
+        page_cache.invalidate('users')
+        db.session.commit()
+        self.assertTrue(SiteVersion.current()[0] == version + 2)
+
+        # commits that change no page leave it alone
+        db.session.commit()
+        self.assertTrue(SiteVersion.current()[0] == version + 2)
+
+    def test_feeds_invalidated_on_flush(self):
+        backend = self.app.extensions['page_cache'].backend
+        generation = backend.generation('feeds')
+        db.session.add(Post(title='hello', body='body of *hello*'))
+        db.session.commit()
+        self.assertTrue(backend.generation('feeds') != generation)
+
+    def test_feeds(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add_all([u, Post(title='hello', body='body of *hello*', author=u)])
+        db.session.commit()
+
+        response = self.client.get(url_for('main.feed'))
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == 'application/atom+xml')
+        self.assertTrue(b'hello' in response.data)
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'MISS')
+        etag = response.headers['ETag']
+        response = self.client.get(url_for('main.feed'), headers={'If-None-Match': etag})
+        self.assertTrue(response.status_code == 304)
+
+        # changing a post regenerates the feed
+        db.session.add(Post(title='world', body='body of world', author=u))
+        db.session.commit()
+        response = self.client.get(url_for('main.feed'), headers={'If-None-Match': etag})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'MISS')
+        self.assertTrue(b'world' in response.data)
+
+        response = self.client.get(url_for('main.tag_feed', name='missing'))
+        self.assertTrue(response.status_code == 404)
+
+        response = self.client.get(url_for('main.sitemap'))
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(url_for('main.post', title='hello', _external=True).encode('utf-8') in response.data)
+        response = self.client.get(url_for('main.sitemap'), headers={'If-None-Match': response.headers['ETag']})
+        self.assertTrue(response.status_code == 304)
+
+    def test_compression(self):
+        self.app.config['ZBLOG_COMPRESS'] = True
+        self.app.config['ZBLOG_COMPRESS_MIN_SIZE'] = 10
+        compress.init_app(self.app)
+        headers = {'Accept-Encoding': 'gzip'}
+
+        response = self.client.get(url_for('main.index'), headers=headers)
+        self.assertTrue(response.headers.get('Content-Encoding') == 'gzip')
+        self.assertTrue('Accept-Encoding' in response.headers.get('Vary'))
+        html = gzip.GzipFile(fileobj=io.BytesIO(response.data)).read()
+        self.assertTrue(b'</html>' in html)
+
+        # the compressed body has a tag of its own, both revalidate
+        etag = response.headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        response = self.client.get(url_for('main.index'), headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertTrue(response.status_code == 304)
+        self.assertTrue(response.headers['ETag'] == etag)
+        response = self.client.get(url_for('main.index'),
+                                   headers={'If-None-Match': etag.replace('-gzip"', '"')})
+        self.assertTrue(response.status_code == 304)
+
+        # page cache hits reuse the compressed body
+        response = self.client.get(url_for('main.index'), headers=headers)
+        self.assertTrue(response.headers.get('X-Page-Cache') == 'HIT')
+        self.assertTrue(compress.stats()['hits'] == 1)
+
+        # clients that do not accept gzip get the page as is
+        response = self.client.get(url_for('main.index'))
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+    def test_metrics(self):
+        self.app.config['ZBLOG_METRICS_HEADERS'] = True
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(int(response.headers['X-Query-Count']) > 0)
+        self.assertTrue(float(response.headers['X-Template-Time']) > 0)
+        self.assertTrue(int(response.headers['X-Response-Size']) == len(response.data))
+
+        # only the administrator may read the metrics
+        response = self.client.get(url_for('main.metrics'))
+        self.assertTrue(response.status_code == 302)
+        u = User(email=self.app.config['ZBLOG_ADMIN'], username='admin', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data={'email': u.email, 'password': 'cat'})
+        response = self.client.get(url_for('main.metrics'))
+        self.assertTrue(response.status_code == 200)
+        data = response.get_data(as_text=True)
+        self.assertTrue('# TYPE zblog_request_duration_seconds histogram' in data)
+        self.assertTrue('zblog_request_queries_count{endpoint="main.index"} 1' in data)
+        self.assertTrue('zblog_page_cache_misses 1' in data)
+
+    def test_query_guard(self):
+        self.assertTrue(normalize("SELECT * FROM post WHERE id IN (?, ?, ?) AND title = 'a' LIMIT 10") ==
+                        'SELECT * FROM post WHERE id IN (?) AND title = ? LIMIT ?')
+        users = [User(email='user{0:d}@example.com'.format(i), username='user{0:d}'.format(i),
+                      password='cat') for i in range(6)]
+        db.session.add_all(users)
+        db.session.commit()
+        ids = [u.id for u in users]
+
+        @self.app.route('/n-plus-one')
+        def n_plus_one():
+            return ','.join(User.query.get(id).email for id in ids)
+
+        self.app.extensions['query_guard'] = 'raise'
+        db.session.remove()
+        with self.assertRaises(RepeatedQueryError) as cm:
+            self.client.get('/n-plus-one')
+        self.assertTrue('n_plus_one issued 6 times' in str(cm.exception))
+
+        # the pages themselves load their posts, tags and authors in bulk
+        for i, u in enumerate(users):
+            db.session.add(Post(title='post {0:d}'.format(i), body='body', author=u))
+        db.session.commit()
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(response.status_code == 200)
+
+    def test_listing_queries(self):
+        john = User(email='john@example.com', username='john', password='cat')
+        flask = Tag(name='flask')
+        db.session.add_all([john, flask])
+        db.session.commit()
+        john_id, flask_id = john.id, flask.id
+        urls = [url_for('main.index'), url_for('main.posts'), url_for('main.tag', name='flask'),
+                url_for('main.user', username='john'), url_for('api.get_posts')]
+
+        def add_posts(first):
+            # each post has an author and a tag of its own next to the shared ones
+            for n in range(first, first + 3):
+                u = User(email='user{0:d}@example.com'.format(n), username='user{0:d}'.format(n), password='cat')
+                t = Tag(name='tag{0:d}'.format(n))
+                posts = [Post(title='post {0:d}'.format(n), body='body', author=u),
+                         Post(title='john {0:d}'.format(n), body='body', author_id=john_id)]
+                db.session.add_all([u, t] + posts)
+                db.session.flush()
+                for post in posts:
+                    db.session.add_all([PostTags(post_id=post.id, tag_id=flask_id),
+                                        PostTags(post_id=post.id, tag_id=t.id)])
+            db.session.commit()
+            db.session.remove()
+
+        def queries(url):
+            offset = len(get_debug_queries())
+            response = self.client.get(url, headers={'Accept': 'application/json'})
+            self.assertTrue(response.status_code == 200)
+            return len(get_debug_queries()) - offset
+
+        # the listings load tags and authors for the whole page at once
+        add_posts(1)
+        few = [queries(url) for url in urls]
+        add_posts(4)
+        self.assertTrue([queries(url) for url in urls] == few)
+
+    def test_freeze(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        p = Post(title='hello', body='body of *hello*', author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        output = tempfile.mkdtemp()
+        try:
+            counts = freeze(output)
+            self.assertTrue(counts['written'] == 5)
+            with open(os.path.join(output, 'post', 'hello', 'index.html'), 'rb') as f:
+                self.assertTrue(b'<em>hello</em>' in f.read())
+            self.assertTrue(os.path.exists(os.path.join(output, 'user', 'john', 'index.html')))
+            self.assertTrue(os.path.exists(os.path.join(output, 'static', 'styles.css')))
+
+            # nothing changed, nothing is rendered
+            counts = freeze(output)
+            self.assertTrue(counts['written'] == 0 and counts['unchanged'] == 5)
+
+            # removed posts are removed from the output
+            db.session.delete(Post.query.filter_by(title='hello').first())
+            db.session.commit()
+            counts = freeze(output)
+            self.assertTrue(counts['removed'] == 1)
+            self.assertFalse(os.path.exists(os.path.join(output, 'post', 'hello', 'index.html')))
+        finally:
+            shutil.rmtree(output)
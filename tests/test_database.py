@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.database import _pragma_statements
+
+__author__ = 'zhangmm'
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['ZBLOG_SQLITE_PRAGMAS'] = {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                                                   'busy_timeout': 1234}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if db.engine.dialect.name == 'sqlite':
+            db.engine.execute('PRAGMA journal_mode = DELETE')
+        self.app_context.pop()
+
+    def test_pragma_order(self):
+        self.assertTrue(_pragma_statements({'cache_size': -2000, 'journal_mode': 'WAL', 'busy_timeout': 10}) == [
+            'PRAGMA busy_timeout = 10', 'PRAGMA journal_mode = WAL', 'PRAGMA cache_size = -2000'])
+
+    def test_report(self):
+        settings = dict(db.report(self.app))
+        self.assertTrue('pool' in settings)
+        if db.engine.dialect.name != 'sqlite':
+            return
+        self.assertTrue(settings['journal_mode'].lower() == 'wal')
+        # NORMAL
+        self.assertTrue(settings['synchronous'] == 1)
+        self.assertTrue(settings['busy_timeout'] == 1234)
+
+    def test_pooled_sqlite_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            app = create_app('testing')
+            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'pooled.sqlite')
+            app.config['SQLALCHEMY_POOL_SIZE'] = 2
+            app.config['SQLALCHEMY_MAX_OVERFLOW'] = 1
+            settings = dict(db.report(app))
+            self.assertTrue(settings['pool'] == 'QueuePool')
+            self.assertTrue(settings['pool_size'] == 2)
+            self.assertTrue(settings['max_overflow'] == 1)
+            db.get_engine(app).dispose()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_pool_size_in_memory(self):
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_POOL_SIZE'] = 2
+        app.config['SQLALCHEMY_MAX_OVERFLOW'] = 1
+        settings = dict(db.report(app))
+        self.assertTrue(settings['pool'] == 'StaticPool')
+        self.assertTrue('pool_size' not in settings)
+        self.assertTrue(settings['journal_mode'] == 'memory')
+        db.get_engine(app).dispose()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import threading
+import unittest
+
+from flask import current_app
+
+from app import create_app, executor
+from app.decorators import background
+from app.executor import QueueFull
+
+__author__ = 'zhangmm'
+
+
+class ExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['ZBLOG_EXECUTOR_WORKERS'] = 1
+        self.app.config['ZBLOG_EXECUTOR_QUEUE_SIZE'] = 1
+        executor.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        executor.shutdown()
+        self.app_context.pop()
+
+    def test_app_context(self):
+        @background
+        def app_name():
+            return current_app.name
+
+        self.assertTrue(app_name().result(5) == self.app.name)
+
+    def test_queue_limit(self):
+        release = threading.Event()
+        first = executor.submit(release.wait, 5)
+        second = executor.submit(release.wait, 5)
+        with self.assertRaises(QueueFull):
+            executor.submit(release.wait, 5)
+        self.assertTrue(executor.stats()['rejected'] == 1)
+        release.set()
+        self.assertTrue(first.result(5) and second.result(5))
+
+        # finished calls make room again
+        self.assertTrue(executor.submit(len, 'abc').result(5) == 3)
+        stats = executor.stats()
+        self.assertTrue(stats['completed'] == 3 and stats['pending'] == 0 and stats['running'] == 0)
+
+    def test_failure(self):
+        future = executor.submit(int, 'not a number')
+        with self.assertRaises(ValueError):
+            future.result(5)
+        self.assertTrue(executor.stats()['failed'] == 1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import unittest
+from datetime import datetime
+
+from app import create_app, db, page_cache
+from app.jobs import task, enqueue, Worker
+from app.models import Post, Job
+
+__author__ = 'zhangmm'
+
+calls = []
+
+
+@task('test_append')
+def append(value):
+    calls.append(value)
+
+
+@task('test_fail')
+def fail():
+    raise ValueError('failed on purpose')
+
+
+class JobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        del calls[:]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_run(self):
+        job = enqueue('test_append', value=1)
+        enqueue('test_append', value=2)
+        db.session.commit()
+        Worker(self.app, concurrency=2).run(once=True)
+        self.assertTrue(sorted(calls) == [1, 2])
+        job = Job.query.get(job.id)
+        self.assertTrue(job.status == 'done')
+        self.assertTrue(job.attempts == 1)
+        self.assertTrue(job.finished is not None)
+
+    def test_lease(self):
+        enqueue('test_append', value=1)
+        db.session.commit()
+        worker = Worker(self.app)
+        job = worker.lease()
+        self.assertTrue(job.status == 'running')
+        self.assertTrue(worker.lease() is None)
+
+        # the lease of a worker that died runs out
+        job.lease_until = datetime(2000, 1, 1)
+        db.session.commit()
+        self.assertTrue(worker.lease().id == job.id)
+
+    def test_expired_lease_of_last_attempt(self):
+        job = enqueue('test_append', max_attempts=1, value=1)
+        db.session.commit()
+        worker = Worker(self.app)
+        job = worker.lease()
+        job.lease_until = datetime(2000, 1, 1)
+        db.session.commit()
+        self.assertTrue(worker.lease() is None)
+        job = Job.query.get(job.id)
+        self.assertTrue(job.status == 'failed')
+        self.assertTrue(job.attempts == 1)
+
+    def test_retry(self):
+        job = enqueue('test_fail', max_attempts=2)
+        db.session.commit()
+        Worker(self.app).run(once=True)
+        job = Job.query.get(job.id)
+        self.assertTrue(job.status == 'queued')
+        self.assertTrue(job.attempts == 1)
+        self.assertTrue(job.run_at > datetime.utcnow())
+        self.assertTrue('failed on purpose' in job.last_error)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        Worker(self.app).run(once=True)
+        job = Job.query.get(job.id)
+        self.assertTrue(job.status == 'failed')
+        self.assertTrue(job.attempts == 2)
+
+    def test_deferred_rendering(self):
+        self.app.config['ZBLOG_DEFER_RENDERING'] = True
+        post = Post(title='deferred', body='*hello*')
+        db.session.add(post)
+        db.session.commit()
+        self.assertTrue(post.body_html is None)
+        self.assertTrue(post.summary_html == '<p>*hello*</p>')
+        job = Job.query.filter_by(name='render_post').one()
+        self.assertTrue('"post_id": {0:d}'.format(post.id) in job.payload)
+
+        Worker(self.app).run(once=True)
+        # the worker wrote on a session of its own, read the post back from the database
+        id = post.id
+        db.session.remove()
+        post = Post.query.get(id)
+        self.assertTrue('<em>hello</em>' in post.body_html)
+        self.assertTrue(post.summary_html is not None)
+
+    def test_deferred_rendering_needs_shared_cache(self):
+        self.app.config['ZBLOG_DEFER_RENDERING'] = True
+        self.app.config['ZBLOG_PAGE_CACHE'] = 'simple'
+        with self.assertRaises(RuntimeError):
+            page_cache.init_app(self.app)
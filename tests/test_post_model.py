@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import re
+import unittest
+from datetime import datetime
+
+from app import create_app, db
+from app.markup import renderer, RENDER_VERSION, rerender_posts
+from app.models import Post
+
+__author__ = 'zhangmm'
+
+
+class PostModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_body_html(self):
+        p = Post(title='post', body='body of the *zblog* post')
+        self.assertTrue(p.body_html == '<p>body of the <em>zblog</em> post</p>')
+        self.assertTrue(p.render_version == RENDER_VERSION)
+
+    def test_render_cache(self):
+        misses = renderer.misses
+        hits = renderer.hits
+        Post(title='one', body='a body rendered **once**')
+        Post(title='two', body='a body rendered **once**')
+        self.assertTrue(renderer.misses == misses + 1)
+        self.assertTrue(renderer.hits == hits + 1)
+
+    def test_unchanged_body_is_not_rendered(self):
+        p = Post(title='post', body='some body')
+        p.body_html = 'kept'
+        p.body = 'some body'
+        self.assertTrue(p.body_html == 'kept')
+        p.body = 'another body'
+        self.assertTrue(p.body_html == '<p>another body</p>')
+
+    def test_unchanged_deferred_body_is_not_rendered(self):
+        db.session.add(Post(title='post', body='some body'))
+        db.session.commit()
+        db.session.expunge_all()
+        post = Post.query.first()
+        self.assertTrue('body' not in post.__dict__)
+        post.body_html = 'kept'
+        post.body = 'some body'
+        self.assertTrue(post.body_html == 'kept')
+        self.assertFalse(getattr(post, '_search_dirty', False))
+        post.body = 'another body'
+        self.assertTrue(post.body_html == '<p>another body</p>')
+        self.assertTrue(post._search_dirty)
+
+    def test_summary(self):
+        renderer.summary_length = 10
+        p = Post(title='post', body='**bold words** and a long tail')
+        self.assertTrue(p.summary_html == '<p><strong>bold words</strong></p>')
+        self.assertTrue(p.summary == p.summary_html)
+
+    def test_listing_defers_content(self):
+        db.session.add(Post(title='post', body='a long body'))
+        db.session.commit()
+        db.session.expunge_all()
+        post = Post.listing(Post.query).first()
+        self.assertTrue('body' not in post.__dict__ and 'body_html' not in post.__dict__)
+        self.assertTrue(post.summary == '<p>a long body</p>')
+        self.assertTrue('body' not in post.__dict__ and 'body_html' not in post.__dict__)
+        db.session.expunge_all()
+        post = Post.listing(Post.query, content=True).first()
+        self.assertTrue('body' in post.__dict__ and 'body_html' in post.__dict__)
+
+        # the listing SELECT itself leaves out the text columns
+        listing = str(Post.listing(Post.query).statement)
+        self.assertIsNone(re.search(r'\bpost\.body(_html)?\b', listing))
+        self.assertTrue('post.summary_html' in listing)
+        self.assertTrue('post.body_html' in str(Post.listing(Post.query, content=True).statement))
+
+    def test_rerender(self):
+        posts = [Post(title='post {0:d}'.format(i), body='*body* {0:d}'.format(i)) for i in range(3)]
+        db.session.add_all(posts)
+        db.session.commit()
+        ids = [p.id for p in posts]
+        old = datetime(2000, 1, 1)
+        Post.query.update({'render_version': None, 'modified': old}, synchronize_session=False)
+        Post.query.filter(Post.id.in_(ids[:2])).update({'body_html': '<p>old</p>'}, synchronize_session=False)
+        db.session.commit()
+
+        # a dry run reports the diffs and writes nothing
+        lines = []
+        self.assertTrue(rerender_posts(workers=1, dry_run=True, progress=lines.append) == (3, 2))
+        self.assertTrue('-<p>old</p>' in lines)
+        self.assertTrue(Post.query.get(ids[0]).body_html == '<p>old</p>')
+
+        self.assertTrue(rerender_posts(workers=1, start_after=ids[0]) == (2, 1))
+        self.assertTrue(Post.query.get(ids[0]).body_html == '<p>old</p>')
+        self.assertTrue(Post.query.get(ids[1]).body_html == '<p><em>body</em> 1</p>')
+
+        # resumes with the posts left behind, only changed posts are touched
+        self.assertTrue(rerender_posts(workers=1) == (1, 1))
+        self.assertTrue(Post.query.get(ids[0]).modified > old)
+        self.assertTrue(Post.query.get(ids[2]).modified == old)
+        self.assertTrue(Post.query.get(ids[2]).render_version == RENDER_VERSION)
+        self.assertTrue(rerender_posts(workers=1) == (0, 0))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from app import create_app, db, search
+from app.models import Post
+from app.search import tokenize, fts5_available, PythonIndex
+
+__author__ = 'zhangmm'
+
+
+def _index_posts(path, first):
+    index = PythonIndex(path, compact_after=7)
+    for id in range(first, first + 25):
+        index.apply([('index', id, u'post', u'body of a post')])
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_tokenize(self):
+        self.assertTrue(tokenize(u'Flask 中文博客') == [u'flask', u'中文', u'文博', u'博客'])
+        self.assertTrue(tokenize(u'中文', unigrams=True) == [u'中文', u'中', u'文'])
+
+    def test_incremental_index(self):
+        p1 = Post(title=u'Flask 入门', body=u'flask is a micro framework')
+        p2 = Post(title=u'随笔', body=u'写一个中文博客')
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        self.assertTrue([p.id for p in search.query(u'flask', 1, 10).items] == [p1.id])
+        self.assertTrue([p.id for p in search.query(u'博客', 1, 10).items] == [p2.id])
+        self.assertTrue([p.id for p in search.query(u'博', 1, 10).items] == [p2.id])
+
+        p1.body = u'flask and 博客'
+        db.session.commit()
+        self.assertTrue(search.query(u'博客', 1, 10).total == 2)
+
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertTrue([p.id for p in search.query(u'博客', 1, 10).items] == [p1.id])
+
+    def test_fts5_index(self):
+        if not fts5_available():
+            self.skipTest('SQLite has no FTS5')
+        self.app.config['ZBLOG_SEARCH_BACKEND'] = 'fts5'
+        search.init_app(self.app)
+        try:
+            # a rolled back transaction leaves the table in place
+            db.session.add(Post(title=u'lost', body=u'rolled back'))
+            db.session.flush()
+            db.session.rollback()
+            p = Post(title=u'随笔', body=u'写一个中文博客')
+            db.session.add(p)
+            db.session.commit()
+            self.assertTrue([post.id for post in search.query(u'博客', 1, 10).items] == [p.id])
+            self.assertTrue([post.id for post in search.query(u'博', 1, 10).items] == [p.id])
+            self.assertTrue(search.query(u'rolled', 1, 10).total == 0)
+        finally:
+            db.session.rollback()
+            db.session.execute('DROP TABLE IF EXISTS post_fts')
+            db.session.commit()
+
+    def test_index_journal(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'index.pickle')
+            writer = PythonIndex(path, compact_after=3)
+            reader = PythonIndex(path, compact_after=3)
+            writer.apply([('index', 1, u'flask', u'micro framework')])
+            writer.apply([('index', 2, u'django', u'framework')])
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(reader.search([u'framework'], 0, 10)[0] == 2)
+
+            # the third change saves the whole index and empties the journal
+            writer.apply([('delete', 1, None, None)])
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue(os.path.getsize(writer.journal) == 0)
+            self.assertTrue(reader.search([u'framework'], 0, 10) == (1, [2]))
+            self.assertTrue(reader.total_length == writer.total_length)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_index_journal_processes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'index.pickle')
+            # four processes appending to and compacting the same journal keep every change
+            processes = [multiprocessing.Process(target=_index_posts, args=(path, first))
+                         for first in range(1, 101, 25)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            self.assertTrue(all(process.exitcode == 0 for process in processes))
+            self.assertTrue(PythonIndex(path).count() == 100)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import unittest
+
+from app import create_app, db
+from app.markup import RENDER_VERSION
+from app.models import User, Post, Tag, PostTags
+from app.seed import seed
+
+__author__ = 'zhangmm'
+
+
+class SeedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_seed(self):
+        counts = seed(users=3, posts=20, tags=5, tags_per_post=(1, 3), body_words=(10, 50), batch_size=8,
+                      workers=1)
+        self.assertTrue(counts == {'users': 3, 'tags': 5, 'posts': 20})
+        self.assertTrue(User.query.count() == 3 and Tag.query.count() == 5 and Post.query.count() == 20)
+        post = Post.query.first()
+        self.assertTrue(post.body_html.startswith('<'))
+        self.assertTrue(post.summary_html is not None and post.render_version == RENDER_VERSION)
+        self.assertTrue(Post.query.filter_by(url_title=post.url_title).count() == 1)
+        pairs = PostTags.query.count()
+        self.assertTrue(20 <= pairs <= 60)
+        self.assertTrue(db.session.query(db.func.count(PostTags.post_id)).join(Post, Post.id == PostTags.post_id)
+                        .scalar() == pairs)
+
+        rows = self.rows()
+
+        # seeding again with another seed adds rows next to the first ones, the database numbers them
+        seed(users=2, posts=5, tags=2, batch_size=8, seed=1, workers=1)
+        self.assertTrue(User.query.count() == 5 and Tag.query.count() == 7 and Post.query.count() == 25)
+        self.assertTrue(db.session.query(db.func.count(db.distinct(Post.url_title))).scalar() == 25)
+
+        # the same seed gives the same users, tags and posts
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        seed(users=3, posts=20, tags=5, tags_per_post=(1, 3), body_words=(10, 50), batch_size=8, workers=1)
+        self.assertTrue(self.rows() == rows)
+
+    @staticmethod
+    def rows():
+        return (db.session.query(User.username, User.email).order_by(User.id).all(),
+                db.session.query(Tag.name).order_by(Tag.id).all(),
+                db.session.query(Post.title, Post.url_title, Post.body).order_by(Post.id).all())
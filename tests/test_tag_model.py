@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# encoding:utf-8
+
+import unittest
+
+from app import create_app, db
+from app.models import Tag, Post, PostTags
+
+__author__ = 'zhangmm'
+
+
+class TagModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cloud(self):
+        t1 = Tag(name='python')
+        t2 = Tag(name='flask')
+        t3 = Tag(name='empty')
+        p1 = Post(title='first', body='first post')
+        p2 = Post(title='second', body='second post')
+        db.session.add_all([t1, t2, t3, p1, p2])
+        db.session.commit()
+        db.session.add_all([PostTags(tag_id=t1.id, post_id=p1.id), PostTags(tag_id=t1.id, post_id=p2.id),
+                            PostTags(tag_id=t2.id, post_id=p2.id)])
+        db.session.commit()
+        cloud = dict(Tag.cloud())
+        self.assertTrue(cloud == {'python': 2, 'flask': 1, 'empty': 0})
+        self.assertTrue(Tag.cloud(t2.id) == [('flask', 1)])
+        self.assertTrue(t1.to_json()['post_count'] == 2)
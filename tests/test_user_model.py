@@ -5,8 +5,9 @@ import unittest
 import time
 from datetime import datetime
 
-from app import create_app, db
-from app.models import User, AnonymousUser
+from app import create_app, db, presence
+from app.markup import RENDER_VERSION, rerender_posts
+from app.models import User, AnonymousUser, verified_tokens
 
 __author__ = 'zhangmm'
 
@@ -58,6 +59,85 @@ class UserModelTestCase(unittest.TestCase):
         u.ping()
         self.assertTrue(u.last_seen > last_seen_before)
 
+    def test_buffered_ping(self):
+        self.app.extensions['presence'].interval = 60
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        last_seen_before = u.last_seen
+        u.ping()
+        last_seen = u.last_seen
+        self.assertTrue(last_seen > last_seen_before)
+        self.assertFalse(db.session.is_modified(u))
+
+        # reloading the user keeps the buffered time
+        db.session.expire(u)
+        self.assertTrue(u.last_seen == last_seen)
+
+        # until it is written with the next flush
+        self.assertTrue(presence.flush() == 1)
+        db.session.expire(u)
+        self.assertTrue(u.last_seen == last_seen)
+
+    def test_verified_token_cache(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token(3600)
+        self.assertTrue(User.verify_auth_token(token) == u)
+        self.assertTrue(verified_tokens.get(token, User.query.get) == u)
+        self.assertTrue(User.verify_auth_token(token) == u)
+
+        # changing the password drops the cached verification and revokes the token
+        u.password = 'dog'
+        db.session.commit()
+        self.assertIsNone(verified_tokens.get(token, User.load_cached))
+        self.assertIsNone(User.verify_auth_token(token))
+        self.assertTrue(User.verify_auth_token(u.generate_auth_token(3600)) == u)
+
+    def test_user_cache(self):
+        u = User(username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        id = u.id
+        self.assertTrue(User.get_cached(username='john') == u)
+
+        # a cached user is merged into a new session without a query
+        db.session.remove()
+        cached = User.get_cached(id=id)
+        self.assertTrue(cached.username == 'john')
+        self.assertTrue(cached in db.session)
+        self.assertFalse(db.session.is_modified(cached))
+
+        # renaming the user invalidates both keys
+        cached.uncache()
+        cached.username = 'susan'
+        db.session.commit()
+        self.assertIsNone(User.get_cached(username='john'))
+        self.assertTrue(User.get_cached(id=id).username == 'susan')
+
+        # last_seen is never served from the cache
+        seen = datetime(2015, 11, 1)
+        User.query.filter_by(id=id).update({'last_seen': seen})
+        db.session.commit()
+        db.session.remove()
+        self.assertTrue(User.get_cached(id=id).last_seen == seen)
+
+    def test_about_me_rerender(self):
+        u = User(username='john', password='cat', about_me='*hello*')
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(u.about_me_render_version == RENDER_VERSION)
+
+        # html of an older sanitizer is rendered again
+        User.query.filter_by(id=u.id).update({'about_me_html': '<p>old</p>', 'about_me_render_version': None})
+        db.session.commit()
+        self.assertTrue(rerender_posts(workers=1) == (1, 1))
+        u = User.query.get(u.id)
+        self.assertTrue('<em>hello</em>' in u.about_me_html)
+        self.assertTrue(u.about_me_render_version == RENDER_VERSION)
+        self.assertTrue(rerender_posts(workers=1) == (0, 0))
+
     def test_gravatar(self):
         u = User(email='zhangmin6105@qq.com', password='cat')
         with self.app.test_request_context('/'):